@@ -0,0 +1,353 @@
+import sys
+import os
+import time
+import json
+import tempfile
+import cv2
+import numpy as np
+
+from packages.ptuSerial.Transform import Tranform
+from packages.opencvController.cvWindowObjects import MotionTracking, DisplayMotionBasic, CenterLight
+from packages.other.Profiler import profiler
+
+__cur_path__ = os.path.dirname(os.path.realpath(__file__))
+__video__ = __cur_path__ + "/celestial/AchernarBase2.avi"  # recorded clip used for the video source
+__mask__ = __cur_path__ + "/mask.png"                       # mask applied to the motion events
+__export__ = __cur_path__ + "/benchmarks/"                 # location of saved results
+__frames__ = 300                                            # number of frames to run through each event
+__size__ = (400, 400)                                       # synthetic frame size (rows, cols)
+__stars__ = 60                                              # number of synthetic stars
+__noise__ = 2.0                                             # synthetic sensor noise (std dev)
+__streak_start__ = 20                                       # frame the synthetic fireball appears
+__streak_length__ = 12                                      # length of the synthetic streak in pixels
+__streak_speed__ = (2.5, 1.5)                               # synthetic fireball pixels per frame (x, y)
+__hit_radius__ = 10.0                                       # max pixel error for a detection to count
+__percentiles__ = [50, 90, 99]
+
+
+class FakePTU:
+    '''
+        Stands in for PTUController so the tracking events can run without hardware
+        * moves instantly to any commanded position
+        * counts the commands that would have been sent over serial
+        * ranges are PTUController's unit limits (counts) converted as it does, so the
+            zenith can be reached over the top as on the real unit
+    '''
+
+    __res__ = 185.1428      # seconds arc per count (full step)
+
+    def __init__(self):
+        self.transform = Tranform()
+        self.panRange = [-3081, 3081]
+        self.tiltRange = [-2324, 2324]
+        self.panRangeDeg = [self.pan_to_deg(self.panRange[0]), self.pan_to_deg(self.panRange[1])]
+        self.tiltRangeDeg = [self.tilt_to_deg(self.tiltRange[1]), self.tilt_to_deg(self.tiltRange[0])]
+        self.panPosDeg = 0.00
+        self.tiltPosDeg = 0.00
+        self.panSpeedDeg = 1
+        self.tiltSpeedDeg = 1
+        self.commands = 0
+
+    def get_pos_and_inst_speed_deg(self):
+        self.commands += 1
+        return self.panPosDeg, self.tiltPosDeg, self.panSpeedDeg, self.tiltSpeedDeg
+
+    def get_pos_estimate_deg(self):
+        return self.panPosDeg, self.tiltPosDeg, self.panSpeedDeg, self.tiltSpeedDeg
+
+    def set_pan_deg(self, deg):
+        self.commands += 1
+        self.panPosDeg = float(deg)
+        return str(deg)
+
+    def set_tilt_deg(self, deg):
+        self.commands += 1
+        self.tiltPosDeg = float(deg)
+        return str(deg)
+
+    def set_pan_speed_deg(self, deg):
+        self.commands += 1
+        self.panSpeedDeg = float(deg)
+        return str(deg)
+
+    def set_tilt_speed_deg(self, deg):
+        self.commands += 1
+        self.tiltSpeedDeg = float(deg)
+        return str(deg)
+
+    def pan_to_deg(self, pan):
+        return float(pan) * self.__res__ / 3600
+
+    def tilt_to_deg(self, tilt):
+        return float(tilt) * self.__res__ / -3600 + self.transform.__payloadTiltOffset__
+
+    def set_accel_deg(self, panAccel, tiltAccel, panBase, tiltBase):
+        self.commands += 4
+
+    def stop(self):
+        self.commands += 1
+
+    def close(self):
+        pass
+
+
+def video_frames(path, count):
+    ''' Yields (frame, None) grayscale frames from a recorded clip. There is no ground truth '''
+    reader = cv2.VideoCapture(path)
+    n = 0
+    while reader.isOpened() and n < count:
+        ret, frame = reader.read()
+        if ret is False or frame is None:
+            break
+        if len(frame.shape) == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        n += 1
+        yield frame, None
+    reader.release()
+
+
+def synthetic_frames(count, size=__size__, seed=0):
+    '''
+        Yields (frame, truth) for a noisy star field with an injected fireball streak
+        * truth is the (x, y) center of the streak in raw image coordinates, or None
+    '''
+    rng = np.random.RandomState(seed)
+    sky = np.zeros(size, np.uint8)
+    for i in range(__stars__):
+        pt = (int(rng.randint(0, size[1])), int(rng.randint(0, size[0])))
+        cv2.circle(sky, pt, int(rng.randint(1, 3)), int(rng.randint(40, 200)), -1)
+    sky = cv2.GaussianBlur(sky, (3, 3), 0)
+
+    start = (size[1] * 0.2, size[0] * 0.3)
+    for n in range(count):
+        noise = rng.normal(0, __noise__, size)
+        frame = np.clip(sky + noise + 10.0, 0, 255).astype(np.uint8)
+        truth = None
+        if n >= __streak_start__:
+            step = n - __streak_start__
+            head = (start[0] + __streak_speed__[0] * step, start[1] + __streak_speed__[1] * step)
+            norm = np.hypot(__streak_speed__[0], __streak_speed__[1])
+            tail = (head[0] - __streak_length__ * __streak_speed__[0] / norm,
+                    head[1] - __streak_length__ * __streak_speed__[1] / norm)
+            if 0 <= head[0] < size[1] and 0 <= head[1] < size[0]:
+                cv2.line(frame, (int(tail[0]), int(tail[1])), (int(head[0]), int(head[1])), 230, 3)
+                truth = ((head[0] + tail[0]) / 2.0, (head[1] + tail[1]) / 2.0)
+        yield frame, truth
+
+
+def time_method(obj, name, stages):
+    ''' Wraps obj.name so each call duration (ms) is appended to stages[name] '''
+    func = getattr(obj, name)
+    times = stages.setdefault(name, [])
+
+    def timed(*args, **kwargs):
+        start = time.time()
+        ret = func(*args, **kwargs)
+        times.append((time.time() - start) * 1000.0)
+        return ret
+    setattr(obj, name, timed)
+
+
+def summarise(times):
+    ''' Returns latency statistics in ms for a list of durations '''
+    if len(times) == 0:
+        return None
+    arr = np.array(times)
+    stats = {"mean": float(arr.mean()), "max": float(arr.max()), "count": len(times)}
+    for p in __percentiles__:
+        stats["p" + str(p)] = float(np.percentile(arr, p))
+    return stats
+
+
+def score(detections):
+    ''' Compares (detected, truth) pairs and returns detection accuracy '''
+    errors = []
+    events = 0
+    falseAlarms = 0
+    for pt, truth in detections:
+        if truth is None:
+            if pt is not None:
+                falseAlarms += 1
+            continue
+        events += 1
+        if pt is not None:
+            errors.append(float(np.hypot(pt[0] - truth[0], pt[1] - truth[1])))
+    hits = [e for e in errors if e <= __hit_radius__]
+    acc = {"eventFrames": events, "detected": len(hits), "falseAlarms": falseAlarms}
+    if events > 0:
+        acc["recall"] = float(len(hits)) / events
+    if len(hits) > 0:
+        acc["meanError"] = float(np.mean(hits))
+        acc["maxError"] = float(np.max(hits))
+    return acc
+
+
+def bench_event(event, frames, run, stageNames, flipTruth=False):
+    '''
+        Runs frames through an event and returns its results
+        * run(event, img) -> detected point (or None)
+        * stageNames are methods of the event that are timed individually
+    '''
+    stages = {}
+    for name in stageNames:
+        time_method(event, name, stages)
+
+    total = []
+    detections = []
+    for img, truth in frames:
+        if flipTruth is True and truth is not None:
+            truth = (truth[0], img.shape[0] - 1 - truth[1])
+        start = time.time()
+        pt = run(event, img)
+        total.append((time.time() - start) * 1000.0)
+        detections.append((pt, truth))
+
+    # The first frame only stores the background
+    total = total[1:]
+    detections = detections[1:]
+
+    result = {"frames": len(total), "run": summarise(total)}
+    if len(total) > 0:
+        result["fps"] = 1000.0 * len(total) / sum(total)
+    result["stages"] = dict((name, summarise(times)) for name, times in stages.items())
+    if hasattr(event, "get_allocations"):
+        result["allocations"] = event.get_allocations()
+    result["accuracy"] = score(detections)
+
+    # Targets the PTU can not reach are never tracked, so score the reachable ones on their own
+    reach = getattr(event, "reach", None)
+    if reach is not None:
+        result["reachableAccuracy"] = score([(pt, truth) for pt, truth in detections
+                                             if truth is None or reach.is_reachable_pt(truth)])
+    return result
+
+
+def run_motion_tracking(event, img):
+    event.run(img)
+    return event.targetPt
+
+
+def run_motion_basic(event, img):
+    event.pt = None
+    event.run(img)
+    return event.pt
+
+
+def run_center_light(event, img):
+    event.contour(img)
+    return event.pt
+
+
+def bench_write_vid(frames):
+    '''
+        Times fireball.write_vid for the buffered frames, writing to a temporary directory
+        * frames are cut to a non square size so a swapped width and height is caught
+        * the video is read back and an IOError is raised if it is missing, empty or the wrong size
+    '''
+    import fireball
+    fireball.__export__ = tempfile.mkdtemp() + "/"
+    imgs = [img[:img.shape[0] * 3 // 4] for img, truth in frames]
+    start = time.time()
+    path = fireball.write_vid(imgs, start - len(imgs) / 30.0, start)
+    elapsed = time.time() - start
+
+    if path is None or os.path.exists(path) is False or os.path.getsize(path) == 0:
+        raise IOError("write_vid did not write a video (is the X264 codec available?)")
+    cap = cv2.VideoCapture(path)
+    ret, img = cap.read()
+    cap.release()
+    if ret is False or img.shape[:2] != imgs[0].shape[:2]:
+        raise IOError("write_vid wrote unreadable or wrongly sized frames to " + path)
+    return {"frames": len(imgs), "seconds": elapsed, "fps": len(imgs) / elapsed if elapsed > 0 else None,
+            "bytes": os.path.getsize(path)}
+
+
+def load_frames(source, count):
+    if source == "video":
+        return list(video_frames(__video__, count))
+    return list(synthetic_frames(count))
+
+
+if __name__ == "__main__":
+    '''
+        Benchmarks the frame pipeline without cameras, a PTU or windows
+            * usage: python benchmark.py [synthetic|video] [frames]
+            * synthetic frames have a known fireball position so detection accuracy is reported
+            * results are printed and saved to /benchmarks as Ymd-HMS-source.json
+    '''
+    source = "synthetic"
+    count = __frames__
+    if len(sys.argv) > 1:
+        source = sys.argv[1]
+    if len(sys.argv) > 2:
+        count = int(sys.argv[2])
+
+    # Run headless
+    cv2.imshow = lambda *args: None
+    cv2.namedWindow = lambda *args: None
+
+    frames = load_frames(source, count)
+    if len(frames) == 0:
+        print "No frames found for source \"" + source + "\""
+        exit(1)
+    mask = cv2.imread(__mask__, 0)
+    if mask is not None and mask.shape != frames[0][0].shape:
+        mask = None
+
+    results = {"source": source, "frames": len(frames), "time": time.strftime("%Y%m%d-%H%M%S")}
+
+    # Motion tracking with a fake PTU
+    ptu = FakePTU()
+    motion = MotionTracking("Bench")
+    motion.assign([ptu])
+    motion.set_mask(mask)
+    motion.enable(True)
+    results["MotionTracking"] = bench_event(motion, frames, run_motion_tracking,
+                                            ["_get_motion_delta", "_get_contours", "_get_target_pt"],
+                                            flipTruth=True)
+    results["MotionTracking"]["ptuCommands"] = ptu.commands
+
+    # Coarse to fine motion tracking
+    ptu = FakePTU()
+    motion = MotionTracking("Bench")
+    motion.pyramid = 2
+    motion.assign([ptu])
+    motion.set_mask(mask)
+    motion.enable(True)
+    results["MotionTrackingPyramid"] = bench_event(motion, frames, run_motion_tracking,
+                                                   ["_get_pyramid_contours", "_get_target_pt"],
+                                                   flipTruth=True)
+    results["MotionTrackingPyramid"]["ptuCommands"] = ptu.commands
+
+    # Mean detection time (ms) against full resolution detection. The rest of the frame is shared
+    full = results["MotionTracking"]["stages"]
+    pyramid = results["MotionTrackingPyramid"]["stages"]["_get_pyramid_contours"]
+    results["MotionTrackingPyramid"]["detectionSpeedup"] = \
+        (full["_get_motion_delta"]["mean"] + full["_get_contours"]["mean"]) / pyramid["mean"]
+
+    # Basic motion display
+    basic = DisplayMotionBasic("Bench")
+    basic.enable(True)
+    results["DisplayMotionBasic"] = bench_event(basic, frames, run_motion_basic, [])
+
+    # Light centering (no ground truth as every star is a candidate)
+    light = CenterLight("Bench")
+    light.enable(True)
+    results["CenterLight"] = bench_event(light, frames, run_center_light, [])
+    del results["CenterLight"]["accuracy"]
+
+    # Video writing
+    results["write_vid"] = bench_write_vid(frames)
+
+    # Stages recorded by the built in profiler
+    results["profiler"] = profiler.summary()
+
+    print json.dumps(results, indent=2, sort_keys=True)
+
+    # Save results
+    if os.path.exists(__export__) is False:
+        os.makedirs(__export__)
+    path = __export__ + results["time"] + "-" + source + ".json"
+    with open(path, "w") as fout:
+        json.dump(results, fout, indent=2, sort_keys=True)
+    print "Saved to ", path
@@ -0,0 +1,156 @@
+import sys
+import time
+import json
+import cv2
+import numpy as np
+
+from packages.opencvController.camera import Camera
+from packages.opencvController.captureThread import CaptureThread
+from packages.opencvController.cvWindowObjects import locate_light
+from packages.ptuSerial.PTUController import PTUController
+from packages.ptuSerial.Transform import Tranform, __settings__
+from packages.ptuSerial import Calibration
+from packages.other import Utilities as u
+
+__pan_step__ = 10.0         # grid spacing (deg)
+__tilt_step__ = 10.0
+__tilt_limits__ = (0.0, 85.0)   # tilt range swept (deg), inside the unit's range
+__speed__ = 60.0            # sweep speed (deg/s)
+__settle__ = 0.5            # seconds after a move is due to finish before frames are used
+__frame_timeout__ = 2.0     # seconds to wait for a settled frame
+__thresh_bound__ = 30       # CenterLight threshold and minimum area for the light
+__min_area__ = 6
+
+
+def grid(panRange, tiltRange, panStep=__pan_step__, tiltStep=__tilt_step__):
+    ''' Pan/tilt grid in a serpentine order so consecutive points are neighbours '''
+    pans = np.arange(panRange[0], panRange[1] + 1e-9, panStep)
+    tilts = np.arange(tiltRange[0], tiltRange[1] + 1e-9, tiltStep)
+    points = []
+    for i in range(len(tilts)):
+        row = pans
+        if i % 2 == 1:
+            row = pans[::-1]
+        points.extend((float(pan), float(tilts[i])) for pan in row)
+    return points
+
+
+def move(PTU, point, prev):
+    '''
+        Commands a move and returns (monotonic time the move has settled, position sent in deg)
+        * the travel time comes from the current speeds so the unit does not need to be polled
+    '''
+    PTU.set_pan_deg(point[0])
+    PTU.set_tilt_deg(point[1])
+    travel = 0.0
+    if prev is not None:
+        panSpeed = max(abs(PTU.panSpeed) * PTU.PTU.panRes / 3600.0, 1e-3)
+        tiltSpeed = max(abs(PTU.tiltSpeed) * PTU.PTU.tiltRes / 3600.0, 1e-3)
+        travel = max(abs(point[0] - prev[0]) / panSpeed, abs(point[1] - prev[1]) / tiltSpeed)
+    return u.monotonic() + travel + __settle__, (PTU.panPosDeg, PTU.tiltPosDeg)
+
+
+def sweep(PTU, wide, payload, points, recorder):
+    '''
+        Drives the PTU through the points and records a sample wherever the light is seen
+        by both cameras (e.g. a spot from a laser boresighted with the payload)
+        * wide and payload are running CaptureThreads
+        * the next move is commanded as soon as the settled frames are in hand, so the
+            detection runs while the PTU is moving
+    '''
+    settled, sent = move(PTU, points[0], None)
+    for i in range(len(points)):
+        # Wait for the move to settle and take the first frames after it
+        remaining = settled - u.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        wideImg, t = wide.get_frame_after(settled, __frame_timeout__)
+        payloadImg, t = payload.get_frame_after(settled, __frame_timeout__)
+        pos = sent
+
+        # Start the next move before processing
+        if i + 1 < len(points):
+            settled, sent = move(PTU, points[i + 1], points[i])
+
+        if wideImg is None or payloadImg is None:
+            print "No frames at", points[i]
+            continue
+
+        # Same orientation and center as MotionTracking
+        wideImg = cv2.flip(wideImg, 0)
+        dims = wideImg.shape
+        center = (dims[0] / 2, dims[1] / 2)
+
+        widePt = locate_light(wideImg, __thresh_bound__, __min_area__)
+        payloadPt = locate_light(payloadImg, __thresh_bound__, __min_area__)
+        if widePt is not None and payloadPt is not None:
+            recorder.add(widePt, center, pos[0], pos[1], payloadPt, payloadImg.shape)
+        print "{}/{} pan {} tilt {} samples {}".format(i + 1, len(points), pos[0], pos[1], len(recorder.samples))
+
+
+def fit(path, settings):
+    transform = Tranform(settings)
+    samples = Calibration.load_samples(path)
+    result = Calibration.fit(samples, transform)
+    print json.dumps(result, indent=2, sort_keys=True)
+
+    transform.save_settings(settings)
+    print "Saved to ", settings
+
+
+if __name__ == "__main__":
+    '''
+        Calibrates the wide angle to PTU transform
+            * usage: python calibrate.py [sweep] samples.csv [settings]
+            * sweep drives the PTU through a grid (see grid) with both cameras running and
+                saves the samples before fitting. Otherwise a saved samples file is fitted
+            * samples are saved by Calibration.CalibrationRecorder
+            * the fitted values are written to the transform settings file (transform.txt by
+                default) which Tranform loads on start up
+    '''
+    args = sys.argv[1:]
+    runSweep = len(args) > 0 and args[0] == "sweep"
+    if runSweep is True:
+        args = args[1:]
+    if len(args) < 1:
+        print "usage: python calibrate.py [sweep] samples.csv [settings]"
+        exit(1)
+    settings = __settings__
+    if len(args) > 1:
+        settings = args[1]
+
+    if runSweep is True:
+        PTU = PTUController("/dev/ttyS0", 9600)
+        PTU.set_pan_speed_deg(__speed__)
+        PTU.set_tilt_speed_deg(__speed__)
+
+        cam = Camera(1, "Wide")
+        payloadCam = Camera(0, "Payload")
+        cam.connect_camera()
+        payloadCam.connect_camera()
+        cam.startCapture()
+        payloadCam.startCapture()
+        wide = CaptureThread(cam)
+        payload = CaptureThread(payloadCam)
+        wide.start()
+        payload.start()
+
+        tiltRange = (max(__tilt_limits__[0], PTU.tiltRangeDeg[0]), min(__tilt_limits__[1], PTU.tiltRangeDeg[1]))
+        points = grid(PTU.panRangeDeg, tiltRange)
+        recorder = Calibration.CalibrationRecorder()
+        start = time.time()
+        try:
+            sweep(PTU, wide, payload, points, recorder)
+        finally:
+            wide.stop()
+            payload.stop()
+            PTU.stop()
+            PTU.close()
+            cam.disconnect_camera()
+            payloadCam.disconnect_camera()
+
+        recorder.save(args[0])
+        print "Swept", len(points), "points in", u.round_float(time.time() - start), "s.", \
+            len(recorder.samples), "samples saved to ", args[0]
+
+    fit(args[0], settings)
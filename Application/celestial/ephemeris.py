@@ -0,0 +1,107 @@
+import time
+import numpy as np
+
+# J2000 positions of bright stars (RA, Dec in degrees)
+__catalogue__ = {
+    "Achernar": (24.4285, -57.2368),
+    "Acrux": (186.6496, -63.0991),
+    "Antares": (247.3519, -26.4320),
+    "Arcturus": (213.9153, 19.1824),
+    "Betelgeuse": (88.7929, 7.4071),
+    "Canopus": (95.9880, -52.6957),
+    "Hadar": (210.9559, -60.3730),
+    "Rigel": (78.6345, -8.2016),
+    "Rigil Kentaurus": (219.9021, -60.8340),
+    "Sirius": (101.2872, -16.7161),
+    "Vega": (279.2347, 38.7837),
+}
+
+# Observing site (deg, longitude east positive)
+__latitude__ = -31.95
+__longitude__ = 115.86
+
+__j2000__ = 2451545.0           # julian date of the J2000 epoch
+__unix_jd__ = 2440587.5         # julian date of the unix epoch
+
+
+def julian_date(times):
+    ''' Julian dates for epoch seconds (UTC) '''
+    return np.asarray(times, np.float64) / 86400.0 + __unix_jd__
+
+
+def sidereal_time(times, longitude):
+    '''
+        Local mean sidereal time (deg) for epoch seconds
+        * IAU 1982 expression for GMST, good to well under a second this century
+    '''
+    jd = julian_date(times)
+    d = jd - __j2000__
+    T = d / 36525.0
+    gmst = 280.46061837 + 360.98564736629 * d + 0.000387933 * T ** 2 - T ** 3 / 38710000.0
+    return np.mod(gmst + longitude, 360.0)
+
+
+def precess(ra, dec, times):
+    '''
+        Precesses J2000 RA/Dec (deg) to the equinox of date (IAU 1976)
+        * nutation and aberration are ignored (< 1 arc minute)
+    '''
+    T = (julian_date(times) - __j2000__) / 36525.0
+    zeta = np.radians((2306.2181 * T + 0.30188 * T ** 2 + 0.017998 * T ** 3) / 3600.0)
+    z = np.radians((2306.2181 * T + 1.09468 * T ** 2 + 0.018203 * T ** 3) / 3600.0)
+    theta = np.radians((2004.3109 * T - 0.42665 * T ** 2 - 0.041833 * T ** 3) / 3600.0)
+
+    ra = np.radians(ra) + zeta
+    dec = np.radians(dec)
+    A = np.cos(dec) * np.sin(ra)
+    B = np.cos(theta) * np.cos(dec) * np.cos(ra) - np.sin(theta) * np.sin(dec)
+    C = np.sin(theta) * np.cos(dec) * np.cos(ra) + np.cos(theta) * np.sin(dec)
+    return np.mod(np.degrees(np.arctan2(A, B) + z), 360.0), np.degrees(np.arcsin(np.clip(C, -1.0, 1.0)))
+
+
+def refraction(alt):
+    ''' Atmospheric refraction (deg) to add to a true altitude (Bennett, standard conditions) '''
+    alt = np.maximum(alt, -1.0)
+    return 1.0 / np.tan(np.radians(alt + 7.31 / (alt + 4.4))) / 60.0
+
+
+def equatorial_to_horizontal(ra, dec, times, latitude, longitude, refract=True):
+    '''
+        Az/alt (deg) of a J2000 RA/Dec at each of the epoch times
+        * az is measured from north through east (0 - 360) as in Stellarium
+        * with refract the apparent altitude is returned (matches Stellarium with its atmosphere on)
+    '''
+    ra, dec = precess(ra, dec, times)
+    ha = np.radians(sidereal_time(times, longitude) - ra)
+    dec = np.radians(dec)
+    lat = np.radians(latitude)
+
+    sinAlt = np.sin(lat) * np.sin(dec) + np.cos(lat) * np.cos(dec) * np.cos(ha)
+    alt = np.degrees(np.arcsin(np.clip(sinAlt, -1.0, 1.0)))
+    az = np.degrees(np.arctan2(-np.sin(ha) * np.cos(dec),
+                               np.cos(lat) * np.sin(dec) - np.sin(lat) * np.cos(dec) * np.cos(ha)))
+    if refract is True:
+        alt = alt + refraction(alt)
+    return np.mod(az, 360.0), alt
+
+
+def trajectory(star, start, duration, step=1.0, latitude=__latitude__, longitude=__longitude__):
+    '''
+        Computes a whole trajectory in one call
+        * star is a __catalogue__ name or an (RA, Dec) pair in degrees (J2000)
+        * start is epoch seconds, duration and step are in seconds
+        * returns times (epoch seconds), az and alt (deg) in the same form as starTracker.load_trajectory
+    '''
+    if isinstance(star, str):
+        star = __catalogue__[star]
+    ra, dec = star
+    times = start + np.arange(0.0, duration + step / 2.0, step)
+    az, alt = equatorial_to_horizontal(ra, dec, times, latitude, longitude)
+    return times, az, alt
+
+
+def to_rows(times, az, alt):
+    ''' Yields [date, time, az, alt] rows (local time) as read from a trajectory csv by generate_list '''
+    for i in range(len(times)):
+        local = time.localtime(times[i])
+        yield [time.strftime("%Y-%m-%d", local), time.strftime("%H:%M:%S", local), str(az[i]), str(alt[i])]
@@ -0,0 +1,117 @@
+import math
+
+from Thesis.Application.packages.opencvController.cvWindowObjects import locate_light
+from Thesis.Application.celestial import trackCompiler as tc
+
+
+class StarCentring:
+    '''
+        Closed loop correction of open loop star tracking using the payload camera
+
+        * each frame the star is found to sub-pixel in an ROI around its last position (see locate_light)
+            and its offset from the crosshair (image center) is converted to degrees
+        * the offset is integrated into pan/tilt corrections that ride on top of the schedule,
+            so every scheduled target is shifted by the current correction
+        * a new correction is taken up within a frame by re-sending the shifted target with
+            the scheduled speed plus a small trim
+        * corrections are bounded so a false detection can not run the PTU away from the schedule
+        * the payload plate scale and axis directions come from the PTU's Tranform
+    '''
+
+    __gain__ = 0.3              # fraction of the measured offset corrected each frame
+    __max_offset__ = 2.0        # largest correction (deg)
+    __max_trim__ = 1.0          # largest speed trim (deg/s)
+    __roi__ = 48                # half width of the search region (px)
+    __lost_frames__ = 5         # frames without the star before searching the whole image
+
+    def __init__(self, PTU, frameRate, threshBound=30, minArea=6):
+        self.PTU = PTU
+        self.frameRate = frameRate
+        self.threshBound = threshBound
+        self.minArea = minArea
+        self.panOffset = 0.0        # deg
+        self.tiltOffset = 0.0       # deg
+        self.pt = None
+        self.missed = 0
+        self.row = None             # last row of the schedule sent
+        self.trimmed = 0            # speed flags currently running trimmed
+        self.corrections = 0
+
+    def send_row(self, row):
+        ''' Sends a schedule row shifted by the current correction '''
+        self.row = row
+        tc.send_row(self._shift(row, row["flags"] | self.trimmed), self.PTU)
+        self.trimmed = 0
+
+    def update(self, img):
+        '''
+            Measures the star in a payload frame and corrects the PTU
+            * returns the (pan, tilt) error in degrees or None if the star was not found
+        '''
+        roi = None
+        if self.pt is not None:
+            roi = (self.pt[0] - self.__roi__, self.pt[1] - self.__roi__, 2 * self.__roi__, 2 * self.__roi__)
+        light = locate_light(img, self.threshBound, self.minArea, roi)
+
+        if light is None:
+            self.missed += 1
+            if self.missed >= self.__lost_frames__:
+                self.pt = None
+            return None
+        pt = light[:2]
+        self.pt = pt
+        self.missed = 0
+
+        # Offset from the crosshair in degrees. Pan moves the star less when pointing up
+        transform = self.PTU.transform
+        dx = (pt[0] - img.shape[1] / 2.0) * transform.__payload_deg_per_px__
+        dy = (pt[1] - img.shape[0] / 2.0) * transform.__payload_deg_per_px__
+        tilt = 0.0
+        if self.row is not None:
+            tilt = self.PTU.tilt_to_deg(self.row["tilt"])
+        panErr = transform.__payload_pan_sign__ * dx / max(math.cos(math.radians(tilt)), 0.2)
+        tiltErr = transform.__payload_tilt_sign__ * dy
+
+        self._correct(self.__gain__ * panErr, self.__gain__ * tiltErr)
+        return panErr, tiltErr
+
+    def _correct(self, panStep, tiltStep):
+        ''' Adds a step to the correction and re-sends the shifted target with trimmed speeds '''
+        panStep = self._bound(self.panOffset + panStep) - self.panOffset
+        tiltStep = self._bound(self.tiltOffset + tiltStep) - self.tiltOffset
+        self.panOffset += panStep
+        self.tiltOffset += tiltStep
+        if self.row is None:
+            return
+
+        flags = 0
+        if abs(panStep) * 3600.0 >= self.PTU.PTU.panRes:
+            flags |= tc.__pan__ | tc.__pan_speed__
+        if abs(tiltStep) * 3600.0 >= self.PTU.PTU.tiltRes:
+            flags |= tc.__tilt__ | tc.__tilt_speed__
+        if flags == 0:
+            # Back to the scheduled speeds once the correction is taken up
+            if self.trimmed != 0:
+                tc.send_row(self._shift(self.row, self.trimmed), self.PTU)
+                self.trimmed = 0
+            return
+
+        # Speed trim to take up the step within a frame
+        row = self._shift(self.row, flags)
+        row["panSpeed"] += int(3600.0 * min(abs(panStep) * self.frameRate, self.__max_trim__) / self.PTU.PTU.panRes)
+        row["tiltSpeed"] += int(3600.0 * min(abs(tiltStep) * self.frameRate, self.__max_trim__) / self.PTU.PTU.tiltRes)
+        tc.send_row(row, self.PTU)
+        self.trimmed = flags & (tc.__pan_speed__ | tc.__tilt_speed__)
+        self.corrections += 1
+
+    def _shift(self, row, flags):
+        ''' Copy of a schedule row with the correction added to its target '''
+        row = row.copy()
+        row["pan"] += int(3600.0 * self.panOffset / self.PTU.PTU.panRes)
+        # tilt counts are reversed (see PTUController.deg_to_tilt)
+        row["tilt"] -= int(3600.0 * self.tiltOffset / self.PTU.PTU.tiltRes)
+        row["flags"] = flags
+        return row
+
+    def _bound(self, offset):
+        return max(-self.__max_offset__, min(self.__max_offset__, offset))
@@ -14,6 +14,4 @@ if __name__ == "__main__":
             writer = csv.writer(fout, delimiter=',')
             writer.writerow(["Date", "Time", "Az", "Alt"])
             for line in fin:
-                mline = re.split(delimiters, line)
-                print mline
-                writer.writerow(mline)
\ No newline at end of file
+                writer.writerow(re.split(delimiters, line))
\ No newline at end of file
@@ -1,36 +1,99 @@
 import csv
 from datetime import datetime
 from Thesis.Application.packages.ptuSerial.PTUController import PTUController
+from Thesis.Application.packages.ptuSerial.Reachability import Reachability
 from Thesis.Application.packages.other import Utilities as u
+from Thesis.Application.celestial import trackCompiler as tc
+from Thesis.Application.celestial import trackSpline as ts
+from Thesis.Application.celestial import ephemeris
+from Thesis.Application.celestial.starCentring import StarCentring
 import math
+import time
+import itertools
+import numpy as np
 from Thesis.Application.packages.opencvController.camera import Camera
 import cv2
 import os
 
+__pan_fit__ = (-0.9923, -0.3099)     # pan = a * az + b
+__tilt_fit__ = (0.9937, 2.0829)      # tilt = a * alt + b
+
+# Accepts single values or numpy arrays
 def az_to_pan(az):
-    az = u.within_pi(az)
-    pan = -0.9923*az - 0.3099
-    return u.within_pi(pan)
+    az = u.within_pi_array(az)
+    pan = __pan_fit__[0]*az + __pan_fit__[1]
+    return u.within_pi_array(pan)
 
 def alt_to_tilt(alt):
-    alt = u.within_pi(alt)
-    tilt = 0.9937 * alt + 2.0829
-    return u.within_pi(tilt)
+    alt = u.within_pi_array(alt)
+    tilt = __tilt_fit__[0] * alt + __tilt_fit__[1]
+    return u.within_pi_array(tilt)
 
-def generate_list(filename):
-    inList = []
-    firstRowCOmplete = False
+def sky_to_pan_tilt(az, alt):
+    return az_to_pan(az), alt_to_tilt(alt)
+
+def check_reachable(az, alt, PTU):
+    '''
+        Warns about trajectory points in the PTU dead zone (see Reachability)
+        * compiled schedules always use the direct pose, so points only reachable flipped
+            over the top are counted as unreachable
+        * returns the number of unreachable points
+    '''
+    reach = Reachability(PTU)
+    reach.sky_map(sky_to_pan_tilt, flip=False)
+    missed = int(np.count_nonzero(~reach.is_reachable_sky(az, alt)))
+    if missed > 0:
+        print "Warning:", missed, "of", len(az), "trajectory points are outside the PTU range"
+    return missed
+
+def iter_rows(filename):
+    ''' Yields the rows of a trajectory csv one at a time '''
     with open(filename) as fin:
         reader = csv.reader(fin, delimiter=',', quotechar='|')
 
+        # ignore first row as this has headers
+        next(reader, None)
         for row in reader:
-            # ignore first row as this has headers
-            if firstRowCOmplete is False:
-                firstRowCOmplete = True
-                continue
-            inList.append(row)
+            if len(row) > 0:
+                yield row
+
+
+def generate_list(filename):
+    return list(iter_rows(filename))
 
-    return inList
+
+def parse_rows(rows):
+    '''
+        Converts [date, time, az, alt] rows into numpy arrays
+        * returns times (epoch seconds, local time), az and alt (deg)
+    '''
+    n = len(rows)
+    times = np.empty(n)
+    az = np.empty(n)
+    alt = np.empty(n)
+    for i in range(n):
+        raw = rows[i]
+        year, month, day = raw[0].split("-")
+        hour, minute, second = raw[1].split(":")
+        times[i] = time.mktime((int(year), int(month), int(day), int(hour), int(minute), int(second), 0, 0, -1))
+        az[i] = float(raw[2])
+        alt[i] = float(raw[3])
+    return times, az, alt
+
+
+def iter_trajectory(filename, chunkRows=None):
+    '''
+        Reads a trajectory csv lazily, chunkRows rows at a time
+        * yields (times, az, alt) arrays as load_trajectory returns for the whole file
+    '''
+    if chunkRows is None:
+        chunkRows = __chunk_rows__
+    rows = iter_rows(filename)
+    while True:
+        chunk = list(itertools.islice(rows, chunkRows))
+        if len(chunk) == 0:
+            return
+        yield parse_rows(chunk)
 
 
 
@@ -49,7 +112,6 @@ def generate_track_data(raw_data):
         # Convert alt to tilt
         tilt = alt_to_tilt(float(raw[3]))
         # Velocities
-        print dt
         timeDelta = (dt - prevTime).total_seconds()
         if timeDelta < 1:
             timeDelta = 1
@@ -92,13 +154,110 @@ def set_ptu_params(track_data_row, PTU):
     PTU.set_pan_deg(track_data_row[1])
     PTU.set_tilt_deg(track_data_row[2])
 
-def track(track_data, PTU, camera=None, vidName = "vid", size=(600,600), frameRate=40.0):
+def load_trajectory(filename):
     '''
-        Iterates through the track_data and sets the PTU accordingly.
-        Also creates a video if a camera is passed to it
+        Reads a trajectory csv into numpy arrays
+        * returns times (epoch seconds), az and alt (deg)
     '''
+    return parse_rows(generate_list(filename))
 
-    first = True
+
+def compile_track(filename, PTU, useCache=True, spline=True):
+    '''
+        Compiles a trajectory csv into a PTU command schedule (see trackCompiler)
+        * with spline the points are resampled every __spline_step__ seconds on a cubic
+            spline and speeds come from its analytic rates (see trackSpline)
+        * without spline the raw points are used with step-wise speeds
+        * the schedule is cached next to the csv as a .npy for the unit's resolution and
+            the fit, tilt offset and speed constants it was compiled with
+    '''
+    # Query the unit as the resolution changes with step mode
+    panRes = PTU.PTU.get_pan_res()
+    tiltRes = PTU.PTU.get_tilt_res()
+    tag = tc.options_tag(__pan_fit__, __tilt_fit__, PTU.transform.__payloadTiltOffset__,
+                         __min_speed__, __max_speed__)
+    if spline is True:
+        tag += "-s" + str(__spline_step__)
+    if useCache is True:
+        schedule = tc.load_cached(filename, panRes, tiltRes, tag)
+        if schedule is not None:
+            return schedule
+
+    times, az, alt = load_trajectory(filename)
+    check_reachable(az, alt, PTU)
+    schedule = compile_arrays(times, az, alt, panRes, tiltRes, PTU.transform.__payloadTiltOffset__, spline)
+    if useCache is True:
+        tc.save_cached(filename, panRes, tiltRes, schedule, tag)
+    return schedule
+
+
+def compile_arrays(times, az, alt, panRes, tiltRes, tiltOffset, spline=True):
+    ''' Compiles az/alt arrays (deg) reached at the epoch times into a PTU command schedule '''
+    if spline is True:
+        times, az, alt, azRate, altRate = ts.resample(times, az, alt, __spline_step__)
+        pan = az_to_pan(az)
+        tilt = alt_to_tilt(alt)
+        pSpeed, tSpeed = tc.rate_speeds(__pan_fit__[0] * azRate, __tilt_fit__[0] * altRate, __max_speed__)
+    else:
+        pan = az_to_pan(az)
+        tilt = alt_to_tilt(alt)
+        pSpeed, tSpeed = tc.track_speeds(times, pan, tilt, __max_speed__)
+
+    return tc.compile_schedule(times, pan, tilt, pSpeed, tSpeed, panRes, tiltRes, tiltOffset,
+                               minSpeed=__min_speed__)
+
+
+def stream_track(filename, PTU, spline=True, chunkRows=None):
+    '''
+        Compiles a trajectory csv into a stream of schedule chunks for track
+        * the csv is read, resampled and compiled a chunk at a time while tracking, so memory
+            use does not grow with the length of the trajectory (nothing is cached)
+    '''
+    chunks = track_stream(iter_trajectory(filename, chunkRows), spline)
+    return tc.compile_stream(chunks, PTU.PTU.get_pan_res(), PTU.PTU.get_tilt_res(),
+                             PTU.transform.__payloadTiltOffset__, minSpeed=__min_speed__)
+
+
+def track_stream(chunks, spline=True):
+    ''' Converts (times, az, alt) chunks into (times, pan, tilt, pSpeed, tSpeed) chunks for tc.compile_stream '''
+    prev = None
+    if spline is True:
+        for times, az, alt, azRate, altRate in ts.resample_stream(chunks, __spline_step__):
+            panRate = __pan_fit__[0] * azRate
+            tiltRate = __tilt_fit__[0] * altRate
+            pSpeed, tSpeed = tc.rate_speeds(panRate, tiltRate, __max_speed__, prev)
+            prev = (panRate[-1], tiltRate[-1])
+            yield times, az_to_pan(az), alt_to_tilt(alt), pSpeed, tSpeed
+    else:
+        for times, az, alt in chunks:
+            pan = az_to_pan(az)
+            tilt = alt_to_tilt(alt)
+            pSpeed, tSpeed = tc.track_speeds(times, pan, tilt, __max_speed__, prev)
+            prev = (times[-1], pan[-1], tilt[-1])
+            yield times, pan, tilt, pSpeed, tSpeed
+
+
+def compile_star(star, start, duration, PTU, step=1.0, spline=True):
+    '''
+        Compiles a catalogue star (or RA/Dec pair) into a PTU command schedule without
+        any trajectory file, using the on-board ephemeris
+        * start is epoch seconds, duration and step are in seconds
+    '''
+    times, az, alt = ephemeris.trajectory(star, start, duration, step)
+    check_reachable(az, alt, PTU)
+    return compile_arrays(times, az, alt, PTU.PTU.get_pan_res(), PTU.PTU.get_tilt_res(),
+                          PTU.transform.__payloadTiltOffset__, spline)
+
+
+def track(schedule, PTU, camera=None, vidName = "vid", size=(600,600), frameRate=40.0, closedLoop=False):
+    '''
+        Replays a compiled schedule (or a stream from stream_track) on the PTU.
+        Also creates a video if a camera is passed to it
+        * closedLoop keeps the star on the payload crosshair (see StarCentring, needs the camera)
+    '''
+    out = None
+    grab = None
+    centring = None
 
     if camera is not None:
         fourcc = cv2.VideoWriter_fourcc(*'X264')
@@ -106,26 +265,42 @@ def track(track_data, PTU, camera=None, vidName = "vid", size=(600,600), frameRa
         path = os.path.dirname(os.path.realpath(__file__)) + "/vids" + str(vidName) + ".avi"
         print path
         out.open(path, fourcc, frameRate, size)
+        if closedLoop is True:
+            centring = StarCentring(PTU, frameRate)
+
+        def grab():
+            img = camera.grab_numpy_image()
+            if img is None:
+                return None
+            return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+    scheduler = tc.execute(schedule, PTU, grab=grab, out=out, frameRate=frameRate, centring=centring)
 
-    for t in track_data:
-        # Update PTU parameters
-        set_ptu_params(t, PTU)
-
-        # wait for next timestamp to pass
-        while datetime.now() < t[0]:
-            if camera is not None and first is False:
-                img = camera.grab_numpy_image()
-                imgCol = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-                if imgCol is not None:
-                    out.write(imgCol)
-        first = False
     if out is not None:
         out.release()
 
+    # Report how closely commands and frames kept to time (ms)
+    stats = scheduler.stats()
+    for name in ["command", "frame"]:
+        if name in stats:
+            print "Lateness", name, ": mean", u.round_float(stats[name]["mean"]), \
+                "p99", u.round_float(stats[name]["p99"]), "max", u.round_float(stats[name]["max"])
+    print "Skipped frames:", stats["skippedFrames"]
+    if centring is not None:
+        print "Corrections:", centring.corrections, "offset", u.round_float(centring.panOffset), \
+            u.round_float(centring.tiltOffset)
+    return stats
+
 
 __input__ = "trajectory.csv"
+__star__ = None             # catalogue star to track from the ephemeris instead of __input__
+__duration__ = 300          # seconds tracked when using the ephemeris
 __max_speed__ = 15.0
 __min_speed__ = 0.01
+__spline_step__ = 2.0       # seconds between resampled trajectory points
+__chunk_rows__ = 1000       # csv rows read at a time when streaming
+__stream__ = False          # compile while tracking rather than up front (long trajectories)
+__closed_loop__ = False     # correct the schedule from the payload camera
 savedFramerate = 10.0
 vidName = "AchernarBase2"
 
@@ -133,9 +308,11 @@ if __name__ == "__main__":
     '''
         Program to track any given target based on the formatted trajectory.csv
         * automatically generates the PTU specific controls
-        * if the position is within the deadzone there may be control issues
+        * points within the deadzone are warned about when compiling (see check_reachable)
         * trajectory.csv can be set by a user or through using the starFormatter.py program to get
             data straight from stellarium
+        * alternatively set __star__ to a catalogue star in ephemeris.py to compute the trajectory
+            on board from now for __duration__ seconds
     '''
     # Connect PTU
     PTU = PTUController("/dev/ttyS0", 9600)
@@ -147,15 +324,20 @@ if __name__ == "__main__":
     payload.connect_camera()
     payload.startCapture()
 
-    # Generate raw data from csv
-    raw_data = generate_list(__input__)
-
-    # Convert to useable PTU data
-    track_data = generate_track_data(raw_data)
-    print "Tracking ...."
+    # Compile the csv (or the star's ephemeris) into a PTU command schedule
+    if __star__ is not None:
+        schedule = compile_star(__star__, time.time() + 10, __duration__, PTU)
+    elif __stream__ is True:
+        schedule = stream_track(__input__, PTU)
+    else:
+        schedule = compile_track(__input__, PTU)
+    if __stream__ is True and __star__ is None:
+        print "Tracking .... (streaming)"
+    else:
+        print "Tracking ....", len(schedule), "commands"
 
     # Activate tracking protocol
-    #track(track_data, PTU, frameRate=float(savedFramerate), vidName=vidName, camera=payload)
+    #track(schedule, PTU, frameRate=float(savedFramerate), vidName=vidName, camera=payload, closedLoop=__closed_loop__)
     PTU.stop()
 
     print ".... Tracking complete"
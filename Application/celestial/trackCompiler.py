@@ -0,0 +1,220 @@
+import os
+import hashlib
+import numpy as np
+
+from Thesis.Application.packages.other.Scheduler import Scheduler
+
+# Command flags. A row only sends the commands whose flag is set
+__pan__ = 1
+__tilt__ = 2
+__pan_speed__ = 4
+__tilt_speed__ = 8
+__all_commands__ = __pan__ | __tilt__ | __pan_speed__ | __tilt_speed__
+
+# A compiled command schedule
+#   time        epoch seconds at which the row is sent (0 sends immediately)
+#   pan, tilt   target position in counts
+#   panSpeed, tiltSpeed   speeds in counts/s (as passed to set_pan_speed/set_tilt_speed)
+#   flags       which of the above have changed and need to be sent. The last row has none
+#               and is due when the final point is reached, so execution lasts until then
+__schedule_dtype__ = np.dtype([("time", "<f8"), ("pan", "<i4"), ("tilt", "<i4"),
+                               ("panSpeed", "<i4"), ("tiltSpeed", "<i4"), ("flags", "u1")])
+__schedule_version__ = 2    # part of the cache name. Changed when compiled schedules change
+
+
+def track_speeds(times, pan, tilt, maxSpeed, prev=None):
+    '''
+        Vectorised speeds (deg/s) needed to reach each point by its time
+        * same rules as starTracker.generate_track_data (1 s minimum delta, clamped to maxSpeed)
+        * the first point is reached at maxSpeed so the PTU is waiting there, unless prev
+            gives the (time, pan, tilt) before it when compiling a stream
+    '''
+    timeDelta = np.maximum(np.diff(times), 1.0)
+    pSpeed = np.empty(len(times))
+    tSpeed = np.empty(len(times))
+    pSpeed[1:] = np.minimum(np.fabs(np.diff(pan)) / timeDelta, maxSpeed)
+    tSpeed[1:] = np.minimum(np.fabs(np.diff(tilt)) / timeDelta, maxSpeed)
+    if prev is None:
+        pSpeed[:1] = maxSpeed
+        tSpeed[:1] = maxSpeed
+    else:
+        timeDelta = max(times[0] - prev[0], 1.0)
+        pSpeed[:1] = min(abs(pan[0] - prev[1]) / timeDelta, maxSpeed)
+        tSpeed[:1] = min(abs(tilt[0] - prev[2]) / timeDelta, maxSpeed)
+    return pSpeed, tSpeed
+
+
+def rate_speeds(panRate, tiltRate, maxSpeed, prev=None):
+    '''
+        Speeds (deg/s) from analytic rates sampled at each point
+        * the speed to reach a point is the mean rate over the interval before it
+        * the first point is reached at maxSpeed so the PTU is waiting there, unless prev
+            gives the (panRate, tiltRate) before it when compiling a stream
+    '''
+    pSpeed = np.empty(len(panRate))
+    tSpeed = np.empty(len(tiltRate))
+    pSpeed[1:] = np.minimum(np.fabs(panRate[1:] + panRate[:-1]) / 2.0, maxSpeed)
+    tSpeed[1:] = np.minimum(np.fabs(tiltRate[1:] + tiltRate[:-1]) / 2.0, maxSpeed)
+    if prev is None:
+        pSpeed[:1] = maxSpeed
+        tSpeed[:1] = maxSpeed
+    else:
+        pSpeed[:1] = min(abs(panRate[0] + prev[0]) / 2.0, maxSpeed)
+        tSpeed[:1] = min(abs(tiltRate[0] + prev[1]) / 2.0, maxSpeed)
+    return pSpeed, tSpeed
+
+
+def compile_schedule(times, pan, tilt, pSpeed, tSpeed, panRes, tiltRes, tiltOffset, minSpeed=0.01):
+    '''
+        Compiles a trajectory in degrees into a command schedule in PTU counts
+        * times are the epoch seconds each point should be reached
+        * the commands for a point are sent when the previous point is reached
+        * commands that do not change from the previous row are removed
+        * an end row (no commands) is due at the last time
+        * panRes and tiltRes are the unit resolutions (seconds arc per count)
+    '''
+    if len(times) == 0:
+        return np.zeros(0, __schedule_dtype__)
+    schedule = _to_counts(times, pan, tilt, pSpeed, tSpeed, panRes, tiltRes, tiltOffset, minSpeed, 0)
+    return np.concatenate((_flag(schedule, None), _end_row(schedule[-1], times[-1])))
+
+
+def compile_stream(chunks, panRes, tiltRes, tiltOffset, minSpeed=0.01):
+    '''
+        compile_schedule for a stream of (times, pan, tilt, pSpeed, tSpeed) chunks
+        * yields a schedule chunk for each input chunk (possibly empty), then the end row
+        * only the last row of the previous chunk is kept, so any length of trajectory
+            compiles in constant memory
+        * the chunks joined together are the same as compile_schedule on the whole trajectory
+    '''
+    prevTime = 0
+    prev = None
+    for times, pan, tilt, pSpeed, tSpeed in chunks:
+        if len(times) == 0:
+            continue
+        schedule = _to_counts(times, pan, tilt, pSpeed, tSpeed, panRes, tiltRes, tiltOffset, minSpeed, prevTime)
+        out = _flag(schedule, prev)
+        prevTime = times[-1]
+        prev = schedule[-1]
+        yield out
+    if prev is not None:
+        yield _end_row(prev, prevTime)
+
+
+def _to_counts(times, pan, tilt, pSpeed, tSpeed, panRes, tiltRes, tiltOffset, minSpeed, prevTime):
+    ''' Every point as a schedule row. The first row is sent at prevTime '''
+    schedule = np.zeros(len(times), __schedule_dtype__)
+
+    # Send time is the previous target time
+    schedule["time"][1:] = times[:-1]
+    schedule["time"][:1] = prevTime
+
+    # Same conversions as PTUController (tilt is reversed and offset by the payload)
+    schedule["pan"] = np.trunc(3600.0 * np.asarray(pan) / panRes)
+    schedule["tilt"] = np.trunc(-3600.0 * (np.asarray(tilt) - tiltOffset) / tiltRes)
+    schedule["panSpeed"] = np.maximum(np.trunc(3600.0 * np.maximum(pSpeed, minSpeed) / panRes), 1)
+    schedule["tiltSpeed"] = np.maximum(np.trunc(3600.0 * np.maximum(tSpeed, minSpeed) / tiltRes), 1)
+    return schedule
+
+
+def _flag(schedule, prev):
+    ''' Flags the values that changed (from prev for the first row, if given) and drops rows with nothing to send '''
+    flags = np.zeros(len(schedule), np.uint8)
+    if prev is None:
+        flags[0] = __all_commands__
+    for name, flag in (("pan", __pan__), ("tilt", __tilt__),
+                       ("panSpeed", __pan_speed__), ("tiltSpeed", __tilt_speed__)):
+        changed = schedule[name][1:] != schedule[name][:-1]
+        flags[1:] |= np.where(changed, flag, 0).astype(np.uint8)
+        if prev is not None and schedule[name][0] != prev[name]:
+            flags[0] |= flag
+    schedule["flags"] = flags
+    return schedule[flags != 0]
+
+
+def _end_row(last, endTime):
+    ''' A row with nothing to send, due at endTime (the final point of the trajectory) '''
+    end = np.zeros(1, __schedule_dtype__)
+    end[0] = last
+    end["time"] = endTime
+    end["flags"] = 0
+    return end
+
+
+def options_tag(*options):
+    ''' Short hash of the compile constants, so a cache is not reused after they change '''
+    return "-" + hashlib.md5(repr(options).encode("ascii")).hexdigest()[:8]
+
+
+def cache_path(csvPath, panRes, tiltRes, tag=""):
+    ''' Cache file for a trajectory compiled with the given resolutions (and compile options tag) '''
+    base = os.path.splitext(csvPath)[0]
+    return base + "-{:.4f}-{:.4f}{}-v{}.npy".format(panRes, tiltRes, tag, __schedule_version__)
+
+
+def load_cached(csvPath, panRes, tiltRes, tag=""):
+    ''' Returns the cached schedule if it is newer than the csv, else None '''
+    path = cache_path(csvPath, panRes, tiltRes, tag)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(csvPath):
+        return np.load(path)
+    return None
+
+
+def save_cached(csvPath, panRes, tiltRes, schedule, tag=""):
+    np.save(cache_path(csvPath, panRes, tiltRes, tag), schedule)
+
+
+def send_row(row, PTU):
+    ''' Sends the changed commands of a schedule row. Speeds are set before positions '''
+    flags = row["flags"]
+    if flags & __pan_speed__:
+        PTU.set_pan_speed(int(row["panSpeed"]))
+    if flags & __tilt_speed__:
+        PTU.set_tilt_speed(int(row["tiltSpeed"]))
+    if flags & __pan__:
+        PTU.set_pan(int(row["pan"]))
+    if flags & __tilt__:
+        PTU.set_tilt(int(row["tilt"]))
+
+
+def execute(schedule, PTU, grab=None, out=None, frameRate=10.0, centring=None):
+    '''
+        Replays a compiled schedule, sleeping until each row is due (see Scheduler)
+        * schedule may also be an iterable of schedule chunks (see compile_stream) which
+            are replayed as they are produced
+        * if grab (returns a colour image) and out (a video writer) are given, frames are
+            written at frameRate from when the first point is reached
+        * with centring (see starCentring) rows are sent through it and every grabbed frame
+            corrects the schedule (closed loop)
+        * returns the scheduler so its lateness statistics can be reported
+    '''
+    chunks = schedule
+    if isinstance(schedule, np.ndarray):
+        chunks = [schedule]
+    scheduler = Scheduler(framePeriod=1.0 / frameRate)
+
+    onFrame = None
+    if grab is not None and (out is not None or centring is not None):
+        def onFrame():
+            img = grab()
+            if img is not None:
+                if centring is not None:
+                    centring.update(img)
+                if out is not None:
+                    out.write(img)
+
+    for chunk in chunks:
+        # Frames start from the first timed row (when the first point is reached)
+        if onFrame is not None and scheduler.frameOrigin is None:
+            timed = chunk["time"][chunk["time"] > 0]
+            if len(timed) > 0:
+                scheduler.start_frames(timed[0])
+
+        def onCommand(i):
+            if centring is not None:
+                centring.send_row(chunk[i])
+            else:
+                send_row(chunk[i], PTU)
+
+        scheduler.run(chunk["time"], onCommand, onFrame)
+    return scheduler
@@ -0,0 +1,148 @@
+import numpy as np
+
+__overlap__ = 4     # raw points of each neighbouring chunk fitted with a chunk when streaming
+
+
+class CubicSpline:
+    '''
+        Natural cubic spline through (t, y) with analytic first derivatives
+
+        * y may have several columns (n, k) which are fitted together
+        * the tridiagonal system is solved in O(n) so long trajectories are cheap
+        * evaluation is vectorised over any number of query times
+    '''
+
+    def __init__(self, t, y):
+        self.t = np.asarray(t, np.float64)
+        self.y = np.asarray(y, np.float64)
+        if self.y.ndim == 1:
+            self.y = self.y[:, np.newaxis]
+        self.h = np.diff(self.t)
+        self.M = self._second_derivatives()
+
+    def _second_derivatives(self):
+        ''' Solves for the second derivative at each knot (zero at both ends) '''
+        n = len(self.t)
+        M = np.zeros(self.y.shape)
+        if n < 3:
+            return M
+
+        h = self.h
+        slope = np.diff(self.y, axis=0) / h[:, np.newaxis]
+        rhs = 6.0 * (slope[1:] - slope[:-1])
+        diag = 2.0 * (h[:-1] + h[1:])
+        upper = h[1:]
+        lower = h[:-1]
+
+        # Thomas algorithm (forward sweep then back substitution)
+        m = n - 2
+        c = np.zeros(m)
+        d = np.zeros((m,) + self.y.shape[1:])
+        c[0] = upper[0] / diag[0]
+        d[0] = rhs[0] / diag[0]
+        for i in range(1, m):
+            denom = diag[i] - lower[i] * c[i - 1]
+            c[i] = upper[i] / denom
+            d[i] = (rhs[i] - lower[i] * d[i - 1]) / denom
+        M[m] = d[m - 1]
+        for i in range(m - 2, -1, -1):
+            M[i + 1] = d[i] - c[i] * M[i + 2]
+        return M
+
+    def _segments(self, tq):
+        tq = np.asarray(tq, np.float64)
+        i = np.clip(np.searchsorted(self.t, tq, side="right") - 1, 0, len(self.t) - 2)
+        h = self.h[i][:, np.newaxis]
+        a = (self.t[i + 1] - tq)[:, np.newaxis]
+        b = (tq - self.t[i])[:, np.newaxis]
+        return i, h, a, b
+
+    def __call__(self, tq):
+        ''' Spline values at tq, shape (len(tq), k) '''
+        i, h, a, b = self._segments(tq)
+        M0, M1 = self.M[i], self.M[i + 1]
+        y0, y1 = self.y[i], self.y[i + 1]
+        return (M0 * a ** 3 + M1 * b ** 3) / (6.0 * h) + (y0 / h - M0 * h / 6.0) * a + (y1 / h - M1 * h / 6.0) * b
+
+    def derivative(self, tq):
+        ''' Analytic first derivative at tq, shape (len(tq), k) '''
+        i, h, a, b = self._segments(tq)
+        M0, M1 = self.M[i], self.M[i + 1]
+        y0, y1 = self.y[i], self.y[i + 1]
+        return (M1 * b ** 2 - M0 * a ** 2) / (2.0 * h) + (y1 - y0) / h - (M1 - M0) * h / 6.0
+
+
+def resample(times, az, alt, step):
+    '''
+        Fits a spline through a sparse az/alt trajectory and samples it every step seconds
+        * az is unwrapped before fitting so passing through +-180 does not swing the fit
+        * returns times, az (+-180), alt and the analytic rates daz/dt and dalt/dt in deg/s
+    '''
+    times = np.asarray(times, np.float64)
+    if len(times) < 2:
+        zero = np.zeros(len(times))
+        return times, np.asarray(az, np.float64), np.asarray(alt, np.float64), zero, zero
+
+    t0 = times[0]
+    tq = np.arange(0.0, times[-1] - t0, step)
+    tq = np.append(tq, times[-1] - t0)
+    return (tq + t0,) + _fit(times - t0, az, alt, tq)
+
+
+def resample_stream(chunks, step, overlap=__overlap__):
+    '''
+        resample for a stream of (times, az, alt) chunks, yielding a resampled chunk for each
+        * each chunk is fitted together with overlap points either side so the joins stay smooth,
+            which holds back one chunk at a time
+        * samples are on the same grid as resample over the whole trajectory
+    '''
+    origin = None
+    index = 0       # next sample on the grid
+    tail = None     # last raw points of the previous chunk
+    cur = None
+    for chunk in chunks:
+        chunk = tuple(np.asarray(c, np.float64) for c in chunk)
+        if len(chunk[0]) == 0:
+            continue
+        if cur is None:
+            origin = chunk[0][0]
+        else:
+            head = tuple(c[:overlap] for c in chunk)
+            out, index = _resample_chunk(cur, tail, head, origin, index, step)
+            tail = tuple(c[-overlap:] for c in cur)
+            yield out
+        cur = chunk
+
+    if cur is not None:
+        out, index = _resample_chunk(cur, tail, None, origin, index, step)
+        yield out
+
+
+def _resample_chunk(cur, tail, head, origin, index, step):
+    ''' Samples cur from grid sample index up to its last point (inclusive if there is no head) '''
+    parts = [p for p in (tail, cur, head) if p is not None]
+    times, az, alt = [np.concatenate(c) for c in zip(*parts)]
+    if len(times) < 2:
+        zero = np.zeros(len(cur[0]))
+        return cur + (zero, zero), index
+
+    end = cur[0][-1] - origin
+    count = max(int(np.ceil(end / step)) - index, 0)
+    tq = (index + np.arange(count)) * step
+    if head is None:
+        tq = np.append(tq, end)
+    return (tq + origin,) + _fit(times - origin, az, alt, tq), index + count
+
+
+def _fit(t, az, alt, tq):
+    '''
+        Fits az (unwrapped) and alt at t and samples them at tq
+        * returns az (+-180), alt and their rates
+    '''
+    azUnwrapped = np.degrees(np.unwrap(np.radians(az)))
+    spline = CubicSpline(t, np.column_stack((azUnwrapped, alt)))
+    pos = spline(tq)
+    rate = spline.derivative(tq)
+
+    azq = np.mod(pos[:, 0] + 180.0, 360.0) - 180.0
+    return azq, pos[:, 1], rate[:, 0], rate[:, 1]
@@ -4,7 +4,9 @@ import os
 
 from packages.opencvController.camera import Camera
 from packages.ptuSerial.PTUController import PTUController
-from packages.opencvController.cvWindowObjects import MotionTracking, DisplayFeed
+from packages.opencvController.captureThread import CaptureThread
+from packages.opencvController.cvWindowObjects import MotionTracking, PayloadTracking, DisplayFeed
+from packages.other.Profiler import profiler
 
 __cur_path__ = os.path.dirname(os.path.realpath(__file__))
 __export__ = __cur_path__ + "/fireballVids/"                # location of saved videos
@@ -13,12 +15,16 @@ __fps__ = 1000                                              # do not change
 __frame_wait__ = int(1000.0 / __fps__)                      # ms / fps
 __save_tracking__ = True                                    # should the payload data be saved to disk
 __accepted_delay__ = 5.0                                    # additional record length after event ends
+__profile__ = __cur_path__ + "/profile.json"                # stage timings saved on exit
+__serial_stats__ = __cur_path__ + "/serial.json"            # PTU link statistics saved on exit
+__max_baud__ = 115200                                       # highest PTU baud rate to negotiate
 
 def write_vid(imgList, start, end, useColor=False):
     '''
         Saves captured video pairs to /tracking
         * name : Ymd-HMS.avi
         * automatically calculates the frame rate
+        * returns the path saved to, or None if nothing could be written
     '''
     if imgList is not None and len(imgList) > 0:
         # Generate fourcc codec
@@ -41,15 +47,20 @@ def write_vid(imgList, start, end, useColor=False):
         frameRate = float(len(imgList)) / float((end - start))
         print frameRate
 
-        # Get image size from the first frame
-        width, height = imgList[0].shape[:2]
+        # Get image size from the first frame (rows, cols)
+        height, width = imgList[0].shape[:2]
 
         # Create writing object and write frames
         out.open(path, fourcc, frameRate, (int(width), int(height)), useColor)
+        if out.isOpened() is False:
+            print "Could not open a video writer for", path
+            return None
         for img in imgList:
             out.write(img)
         print "Saved to ", path
         out.release()
+        return path
+    return None
 
 
 if __name__ == "__main__":
@@ -58,11 +69,12 @@ if __name__ == "__main__":
             * Requires : connected BFLY cameras and serial PTU
         Functions:
             * tracks moving light sources
+            * hands fine tracking to the payload camera once it sees the target (see PayloadTracking)
             * records events with a buffer after motion has stopped
             * saves to /fireballVid with a filename reflecting datetime
     '''
     # Create PTU control object
-    PTU = PTUController("/dev/ttyS0", 9600)
+    PTU = PTUController("/dev/ttyS0", 9600, maxBaud=__max_baud__)
     PTU.PTU.write(" FT ")   # enable terse mode
     PTU.PTU.change_tilt_mode("H")   # Set pan and tilt mode to half stepping
     PTU.PTU.change_pan_mode("H")
@@ -86,18 +98,29 @@ if __name__ == "__main__":
     # Create motion tracking object
     motionTracking = MotionTracking("Wide")
     motionTracking.assign([PTU])
+    motionTracking.pyramid = 2      # coarse to fine detection
 
     # Apply mask to motion tracking (see maskGenerator to create your own)
     mask = cv2.imread("mask.png", 0)    # 0 is grayscale
     motionTracking.set_mask(mask)
 
-    # Create payload display object
+    # Create payload fine tracking and display objects
+    payloadTracking = PayloadTracking("Payload")
+    payloadTracking.assign([PTU])
+    motionTracking.set_payload(payloadTracking)
     disp = DisplayFeed("Payload")
 
     # Enable CVEvents
     motionTracking.enable(True)
+    payloadTracking.enable(True)
     disp.enable(True)
 
+    # The wide angle is grabbed in the background so the loop runs at the payload frame rate
+    wide = CaptureThread(cam)
+    wide.start()
+    wideTime = None
+    isTracking = False
+
     # image storage
     payloadImgs = []
 
@@ -105,11 +128,14 @@ if __name__ == "__main__":
     residual = None
     while 1:
         # Get images from capture devices
-        wideRaw = cam.grab_numpy_image()
         payloadRaw = payload.grab_numpy_image()
+        wideRaw, frameTime = wide.get_frame()
 
-        # Process images
-        wideImg, isTracking = motionTracking.run(wideRaw)
+        # Process images. The payload loop runs every payload frame, the wide loop on each new wide frame
+        payloadTracking.run(payloadRaw)
+        if frameTime is not None and frameTime != wideTime:
+            wideTime = frameTime
+            wideImg, isTracking = motionTracking.run(wideRaw)
         payloadImg = disp.run(payloadRaw)
 
         # Determine if a video should still be recorded
@@ -143,6 +169,12 @@ if __name__ == "__main__":
     PTU.set_tilt_speed(500)
 
     # Release objects
+    wide.stop()
     PTU.close()
     cam.disconnect_camera()
     payload.disconnect_camera()
+
+    # Save stage timings and link statistics
+    profiler.dump(__profile__)
+    PTU.PTU.telemetry.dump(__serial_stats__)
+    print "Stage timings saved to ", __profile__
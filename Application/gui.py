@@ -1,8 +1,12 @@
+import os
 import npyscreen as ns
 
 from packages.guiComponents import winForms
 from packages.opencvController import cvWindowController as cwc, cvWindowObjects as wo, camera
 from packages.ptuSerial.PTUController import PTUController
+from packages.other.Profiler import profiler
+
+__profile__ = os.path.dirname(os.path.realpath(__file__)) + "/profile.json"    # stage timings saved on exit
 
 
 class App( ns.NPSAppManaged ):
@@ -22,6 +26,9 @@ class App( ns.NPSAppManaged ):
         self.addForm("WIDE", winForms.WideMenu, name="Wide Angle Vision").bind(
             "MAIN", bindings=[CVController.get_set("Wide Angle"), PTUController])
 
+        self.addForm("PROFILER", winForms.ProfilerMenu, name="Stage Timings").bind(
+            "MAIN", bindings=[profiler])
+
         self.addForm("CREDITS", winForms.Credits, name="Credits").bind(
             "MAIN")
 
@@ -68,6 +75,9 @@ if __name__ == "__main__":
     # Stop image display controller threads
     CVController.stop()
 
+    # Save stage timings
+    profiler.dump(__profile__)
+
     # Let the user know that everything is complete
     print "*** Fireball tracking system successfully closed! ***"
     exit(0)
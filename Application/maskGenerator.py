@@ -1,13 +1,18 @@
 import cv2
 import os
+import sys
+import time
 import numpy as np
 
 from packages.opencvController.camera import Camera
+from packages.other import Utilities as u
 
 __loc__ = __cur_path__ = os.path.dirname(os.path.realpath(__file__)) + "/"
 __filename__ = "mask.png"
 __frame_wait__ = 10
 __enter__ = 10
+__auto_duration__ = 180.0   # seconds of frames analysed in auto mode
+__auto_interval__ = 1.0     # seconds between analysed frames
 
 
 class Mask:
@@ -44,7 +49,6 @@ class Mask:
                     else:
                         cv2.line(imgCol, self.pts[i], self.pts[len(self.pts) - 1], self.__red__, 2)
                     cv2.circle(imgCol, self.pts[i], 2, self.__blue__, 3)
-            cv2.
         return imgCol
 
 
@@ -73,13 +77,154 @@ class Mask:
         self.pts = []
 
 
+class AutoMask:
+    '''
+        Generates a mask from the statistics of a few minutes of frames instead of a polygon
+        * frames are sampled every interval seconds into a running per pixel mean, variance
+            and maximum (float buffers updated in place)
+        * lens: pixels with a mean above __dark__ (the fisheye image circle)
+        * sky vs horizon / foreground: an Otsu split of the smoothed mean over the lens, as the
+            foreground is a silhouette against the sky glow. If the two sides differ by less than
+            __contrast__ everything in the lens is sky
+        * light pollution: pixels with a mean above __bright__, or that saturate, or that
+            flicker (std above __flicker__ times the median sky std) are excluded
+        * the result is opened, closed and eroded by __margin__ px (moving branches and glare
+            edges), blobs under __min_area__ are dropped
+        * exported in the mask.png format: white is tracked, black is ignored (as Mask)
+    '''
+
+    __dark__ = 4            # mean below which pixels are outside the lens
+    __contrast__ = 6        # mean difference needed to split sky and foreground
+    __bright__ = 120        # mean above which the sky is light polluted
+    __saturated__ = 250     # maximum at which a pixel saturated
+    __flicker__ = 4.0       # std above this many times the median sky std is flicker
+    __blur__ = 15           # smoothing of the mean before classifying (px, odd)
+    __margin__ = 5          # px eroded from the mask edges
+    __min_area__ = 500      # smallest sky region kept (px)
+
+    def __init__(self, exportPath, interval=__auto_interval__):
+        self.exportPath = exportPath
+        self.interval = interval
+        self.count = 0
+        self.nextTime = None
+        self.sum = None
+        self.sumSq = None
+        self.max = None
+        self.mask = None
+
+    def add(self, img):
+        ''' Adds a frame to the statistics if one is due. Returns True if it was used '''
+        now = u.monotonic()
+        if img is None or (self.nextTime is not None and now < self.nextTime):
+            return False
+        self.nextTime = now + self.interval
+        if self.sum is None:
+            self.sum = np.zeros(img.shape, np.float64)
+            self.sumSq = np.zeros(img.shape, np.float64)
+            self.max = np.zeros(img.shape, np.uint8)
+            self.frame = np.empty(img.shape, np.float64)
+        np.copyto(self.frame, img)
+        self.sum += self.frame
+        self.frame *= self.frame
+        self.sumSq += self.frame
+        np.maximum(self.max, img, out=self.max)
+        self.count += 1
+        return True
+
+    def classify(self):
+        ''' Builds and returns the mask (uint8, 255 is tracked) '''
+        if self.count < 2:
+            return None
+        mean = self.sum / self.count
+        std = np.sqrt(np.maximum(self.sumSq / self.count - mean * mean, 0))
+        smooth = cv2.GaussianBlur(np.clip(mean, 0, 255).astype(np.uint8), (self.__blur__, self.__blur__), 0)
+
+        # Lens region
+        lens = smooth > self.__dark__
+        if np.count_nonzero(lens) == 0:
+            return None
+
+        # Light pollution. Left out of the sky split so it can not be taken as the sky
+        bright = (smooth >= self.__bright__) | (self.max >= self.__saturated__)
+        dark = lens & ~bright
+        if np.count_nonzero(dark) == 0:
+            return None
+
+        # Sky (bright side of an Otsu split) vs foreground silhouettes
+        values = smooth[dark].reshape(-1, 1)
+        level, temp = cv2.threshold(values, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        upper = values[values > level]
+        lower = values[values <= level]
+        sky = dark
+        if len(upper) > 0 and len(lower) > 0 and upper.mean() - lower.mean() >= self.__contrast__:
+            sky = dark & (smooth > level)
+
+        # Flicker compared with the typical sky
+        skyStd = np.median(std[sky]) if np.count_nonzero(sky) > 0 else 0.0
+        polluted = bright | (std > self.__flicker__ * max(skyStd, 0.5))
+        polluted = cv2.dilate(polluted.astype(np.uint8), np.ones((self.__blur__, self.__blur__), np.uint8)) > 0
+        mask = (sky & ~polluted).astype(np.uint8) * 255
+
+        # Clean up
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (self.__blur__, self.__blur__))
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+        size = 2 * self.__margin__ + 1
+        mask = cv2.erode(mask, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size)))
+        n, labels, stats, centroids = cv2.connectedComponentsWithStats(mask)
+        for i in range(1, n):
+            if stats[i, cv2.CC_STAT_AREA] < self.__min_area__:
+                mask[labels == i] = 0
+
+        self.mask = mask
+        return mask
+
+    def export(self):
+        print "Exporting mask as \"" + self.exportPath + "\""
+        if self.mask is not None:
+            cv2.imwrite(self.exportPath, self.mask)
+            print "Tracked fraction ", u.round_float(float(np.count_nonzero(self.mask)) / self.mask.size)
+
+
+
+def auto(cam, duration=__auto_duration__):
+    ''' Samples the camera for duration seconds and exports an AutoMask '''
+    mask = AutoMask(__loc__ + __filename__)
+    end = time.time() + duration
+    print "Analysing frames for", duration, "s"
+    while time.time() < end:
+        img = cam.grab_numpy_image()
+        if img is not None:
+            mask.add(cv2.flip(img, 0))
+    print mask.count, "frames analysed"
+    if mask.classify() is not None:
+        mask.export()
+        cv2.namedWindow("Auto Mask", cv2.WINDOW_NORMAL)
+        cv2.imshow("Auto Mask", mask.mask)
+        cv2.waitKey(0)
+
 
 if __name__ == "__main__":
+    '''
+        Generates mask.png for MotionTracking.set_mask
+            * usage: python maskGenerator.py [auto [seconds]]
+            * auto analyses the sky for __auto_duration__ seconds (see AutoMask). Otherwise the
+                polygon is drawn by hand (see Mask)
+    '''
     # Create image source
     cam = Camera(1, "Wide")
     cam.connect_camera()
     cam.startCapture()
 
+    if len(sys.argv) > 1 and sys.argv[1] == "auto":
+        duration = __auto_duration__
+        if len(sys.argv) > 2:
+            duration = float(sys.argv[2])
+        auto(cam, duration)
+        cam.disconnect_camera()
+        cv2.destroyAllWindows()
+        exit(0)
+
     # Create masking object
     mask = Mask(__loc__ + __filename__)
 
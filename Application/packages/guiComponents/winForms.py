@@ -36,6 +36,10 @@ class MainMenu(ns.ActionFormMinimal):
         self.butWideAngle = self.add(ns.ButtonPress, name="Wide Angle Control")
         self.butWideAngle.whenPressed = self.on_wideAngle
 
+        # Stage timings
+        self.butProfiler = self.add(ns.ButtonPress, name="Stage Timings")
+        self.butProfiler.whenPressed = self.on_profiler
+
         # Credits
         self.nextrely += 1
         self.butCredits = self.add(ns.ButtonPress, name="Credits")
@@ -54,6 +58,9 @@ class MainMenu(ns.ActionFormMinimal):
         self.parentApp.switchForm("WIDE")
         pass
 
+    def on_profiler(self):
+        self.parentApp.switchForm("PROFILER")
+
     def on_credits(self):
         self.parentApp.switchForm("CREDITS")
 
@@ -110,6 +117,35 @@ class CameraInfo(ns.ActionFormMinimal, winFormBase):
         self.parentApp.setNextForm(self.ret_form_id)
 
 
+# Displays the live stage timings of the processing loop
+class ProfilerMenu(ns.ActionFormMinimal, winFormBase):
+
+    def bind(self, ret_form_id, bindings=None):
+        self.profiler = bindings[0]
+        self.ret_form_id = ret_form_id
+
+        # Buttons
+        self.butRefresh = bs.add_button(self, "Refresh", self.on_refresh)
+        self.butReset = bs.add_button(self, "Reset", self.on_reset, prevButton=self.butRefresh)
+
+        # Timing table (ms)
+        self.nextrely += 1
+        self.table = bs.add_text_mult(self, "Stage timings (ms)", rows=16)
+        self.on_refresh()
+
+    def on_refresh(self):
+        self.table.values = self.profiler.report()
+        self.display()
+
+    def on_reset(self):
+        self.profiler.reset()
+        self.on_refresh()
+
+    # Called when the window is closed
+    def on_ok(self):
+        self.parentApp.setNextForm(self.ret_form_id)
+
+
 # Contains the credits of the project
 class Credits(ns.ActionFormMinimal, winFormBase):
 
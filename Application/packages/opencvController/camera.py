@@ -2,6 +2,8 @@ import numpy as np
 import PyCapture2
 from typing import List
 
+from .. other.Profiler import profiler
+
 
 class Camera:
 
@@ -81,6 +83,7 @@ class Camera:
     # Returns an image as an opencv compatible numpy array
     def grab_numpy_image(self):
         if self.cam is not None:
+            t = profiler.start()
             try:
                 rawImage = self.cam.retrieveBuffer()
                 cvImage = np.array(rawImage.getData(), dtype="uint8").reshape(
@@ -89,6 +92,8 @@ class Camera:
                 return cvImage
             except:
                 return None
+            finally:
+                profiler.stop("capture", t)
         else:
             return None
 
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from .. other import Utilities as u
+
+__timeout__ = 3
+
+
+class CaptureThread(threading.Thread):
+    '''
+        Grabs frames from a camera continuously in the background
+        * only the latest frame is kept, with the monotonic time it was grabbed
+        * get_frame_after waits for a frame grabbed after a given time, so a caller can
+            ask for the first frame after a move has settled without polling the camera
+    '''
+
+    def __init__(self, cam):
+        super(CaptureThread, self).__init__()
+        self.daemon = True
+        self.cam = cam
+        self.enabled = False
+        self.frame = None
+        self.frameTime = None
+        self.count = 0
+        self.condition = threading.Condition()
+
+    def run(self):
+        while self.enabled:
+            img = self.cam.grab_numpy_image()
+            if img is None:
+                time.sleep(0.001)
+                continue
+            with self.condition:
+                self.frame = img
+                self.frameTime = u.monotonic()
+                self.count += 1
+                self.condition.notify_all()
+
+    def start(self):
+        self.enabled = True
+        super(CaptureThread, self).start()
+
+    def stop(self):
+        self.enabled = False
+        if self.isAlive():
+            self.join(__timeout__)
+
+    def get_frame(self):
+        ''' Returns the latest (frame, monotonic time) '''
+        with self.condition:
+            return self.frame, self.frameTime
+
+    def get_frame_after(self, start, timeout=1.0):
+        ''' Waits for a frame grabbed after the monotonic time start. Returns (frame, time) or (None, None) '''
+        deadline = u.monotonic() + timeout
+        with self.condition:
+            while self.frameTime is None or self.frameTime <= start:
+                remaining = deadline - u.monotonic()
+                if remaining <= 0:
+                    return None, None
+                self.condition.wait(remaining)
+            return self.frame, self.frameTime
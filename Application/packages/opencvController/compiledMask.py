@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+
+
+class CompiledMask:
+    '''
+        A mask that has been prepared once so it can be applied cheaply every frame
+
+        * the mask is reduced to the bounding box of its active (non zero) pixels
+        * only the pixels inside the bounding box are ever processed
+        * all outputs are written into buffers that are allocated here and reused
+        * active pixels are white (255) and excluded pixels are black (0) as per mask.png
+        * the mask must be the frame size. The first frame is checked and a ValueError raised
+            if it is not, as cropping silently reads the wrong pixels otherwise
+    '''
+
+    __high__ = 255      # binary value of an active pixel
+
+    def __init__(self, mask):
+        # Force to a binary mask so bitwise operations act as a pure mask
+        ret, binary = cv2.threshold(mask, 0, self.__high__, cv2.THRESH_BINARY)
+
+        # Bounding box of the active region (x, y, width, height)
+        pts = cv2.findNonZero(binary)
+        if pts is not None:
+            self.rect = cv2.boundingRect(pts)
+        else:
+            self.rect = (0, 0, binary.shape[1], binary.shape[0])
+        x, y, w, h = self.rect
+
+        # Slices used to crop full frames to the active region (views, no copy)
+        self.offset = (x, y)
+        self.rows = slice(y, y + h)
+        self.cols = slice(x, x + w)
+        self.shape = binary.shape
+        self.checked = False
+
+        # Cropped mask. If every pixel in the box is active the mask can be skipped
+        self.roiMask = np.ascontiguousarray(binary[self.rows, self.cols])
+        self.full = cv2.countNonZero(self.roiMask) == w * h
+
+        # Fraction of the frame that is processed
+        self.coverage = float(w * h) / float(binary.shape[0] * binary.shape[1])
+
+        # Preallocated output buffers (pixels outside the mask are never written so stay 0)
+        self.maskedBuf = np.zeros((h, w), np.uint8)
+        self.deltaBuf = np.zeros((h, w), np.uint8)
+
+    def crop(self, img):
+        ''' Returns the active region of a full frame as a view '''
+        if self.checked is False:
+            self.check(img)
+        return img[self.rows, self.cols]
+
+    def check(self, img):
+        ''' Raises a ValueError if a frame is not the mask size '''
+        if img.shape[:2] != self.shape[:2]:
+            raise ValueError("Mask is {}x{} but the frame is {}x{}".format(self.shape[1], self.shape[0],
+                                                                        img.shape[1], img.shape[0]))
+        self.checked = True
+
+    def apply(self, img):
+        ''' Returns the masked active region of a full frame (reuses the same buffer) '''
+        if self.full is True:
+            return self.crop(img)
+        return cv2.bitwise_and(self.crop(img), self.roiMask, dst=self.maskedBuf)
+
+    def subtract(self, cur, bg):
+        '''
+            Masked positive frame delta (cur - bg) over the active region only
+            * the mask is applied as part of the subtraction so each frame is read once
+            * returns a buffer that is overwritten on the next call
+        '''
+        if self.full is True:
+            return cv2.subtract(self.crop(cur), self.crop(bg), dst=self.deltaBuf)
+        return cv2.subtract(self.crop(cur), self.crop(bg), dst=self.deltaBuf, mask=self.roiMask)
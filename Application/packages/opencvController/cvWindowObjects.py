@@ -1,4 +1,5 @@
 import cv2
+import numpy as np
 import math
 import cmath
 import os
@@ -6,13 +7,22 @@ import copy
 import time
 
 from .. ptuSerial.PTUController import PTUController
+from .. ptuSerial.SlewPlanner import SlewPlanner
+from .. ptuSerial.Reachability import Reachability
 from .. other import Utilities as u
+from .. other.Profiler import profiler
+from . compiledMask import CompiledMask
+from . frameBuffers import FrameBuffers
+from . noiseMap import NoiseMap
+from . suppressionMap import SuppressionMap
 
 __red__ = (0, 0, 255)
 __green__ = (0, 255, 0)
 __blue__ = (255, 0, 0)
 __black__ = (0, 0, 0)
 __white__ = (255, 255, 255)
+__centroid_roi__ = 5        # half width of the sub-pixel centroid window (px)
+__quantisation__ = 0.29     # noise floor of an 8 bit pixel (1 / sqrt(12))
 
 def draw_line_from_angle(img, center, angle, length, color, width=2):
     x = int(center[0] + length * (math.cos(math.radians(angle))))
@@ -23,6 +33,178 @@ def draw_line_from_angle(img, center, angle, length, color, width=2):
 def draw_arc(img, center, start, end, radius, color, width=2):
     cv2.ellipse(img, center, (radius, radius), 0, start, end, color, width)
 
+def clip_roi(roi, shape):
+    ''' Clips an (x, y, w, h) region to an image of the given shape '''
+    x = min(max(int(roi[0]), 0), shape[1])
+    y = min(max(int(roi[1]), 0), shape[0])
+    w = min(int(roi[0] + roi[2]), shape[1]) - x
+    h = min(int(roi[1] + roi[3]), shape[0]) - y
+    return x, y, max(w, 0), max(h, 0)
+
+def find_light(img, threshBound, minArea, roi=None):
+    '''
+        Centroid of the largest blob brighter than threshBound (as used by CenterLight)
+        * roi (x, y, w, h) limits the search to part of the image so only that part is
+            converted and thresholded. The point is still in full image coordinates
+        * colour images are converted to gray
+        * returns (x, y) or None if no blob is larger than minArea
+    '''
+    offset = (0, 0)
+    if roi is not None:
+        x, y, w, h = clip_roi(roi, img.shape)
+        img = img[y:y + h, x:x + w]
+        offset = (x, y)
+    if img.size == 0:
+        return None
+    if len(img.shape) == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    ret, thresh = cv2.threshold(img, threshBound, 255, 0)
+    temp, contours, hierarchy = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+
+    pt = None
+    prevArea = minArea
+    for c in contours:
+        # check for largest area point
+        cArea = cv2.contourArea(c)
+        if cArea > prevArea:
+            M = cv2.moments(c)
+            if M["m00"] != 0:
+                prevArea = cArea
+                pt = (int(M["m10"] / M["m00"]), int(M["m01"] / M["m00"]))
+    return pt
+
+def centroid(img, pt, halfWidth=__centroid_roi__, bg=None):
+    '''
+        Sub-pixel intensity weighted centroid in a window about an integer point
+        * bg (a full background frame) is subtracted if given. The remaining level and noise
+            come from the window edge and only pixels above the noise are weighted
+        * returns (x, y, sigma) with sigma the 1 sigma position error (px) from the edge noise,
+            or None if nothing is above the noise
+    '''
+    x, y, w, h = clip_roi((int(pt[0]) - halfWidth, int(pt[1]) - halfWidth, 2 * halfWidth + 1, 2 * halfWidth + 1),
+                          img.shape)
+    if w < 3 or h < 3:
+        return None
+    win = img[y:y + h, x:x + w]
+    if len(win.shape) == 3:
+        win = cv2.cvtColor(win, cv2.COLOR_BGR2GRAY)
+    win = win.astype(np.float32)
+    if bg is not None:
+        win -= bg[y:y + h, x:x + w]
+
+    # Level and noise (median absolute deviation) of the window edge
+    edge = np.concatenate((win[0], win[-1], win[1:-1, 0], win[1:-1, -1]))
+    level = np.median(edge)
+    noise = max(1.4826 * np.median(np.abs(edge - level)), __quantisation__)
+    win -= level
+    ret, win = cv2.threshold(win, noise, 0, cv2.THRESH_TOZERO, dst=win)
+
+    M = cv2.moments(win)
+    if M["m00"] <= 0:
+        return None
+    cx = M["m10"] / M["m00"]
+    cy = M["m01"] / M["m00"]
+
+    # Error of a weighted mean with equal noise on every weighted pixel
+    ys, xs = np.nonzero(win)
+    spread = np.sum((xs - cx) ** 2 + (ys - cy) ** 2)
+    sigma = noise * math.sqrt(spread) / M["m00"]
+    return x + cx, y + cy, float(sigma)
+
+def locate_light(img, threshBound, minArea, roi=None, halfWidth=__centroid_roi__):
+    '''
+        Sub-pixel find_light
+        * returns (x, y, sigma) as centroid or None if no light is found
+    '''
+    pt = find_light(img, threshBound, minArea, roi)
+    if pt is None:
+        return None
+    light = centroid(img, pt, halfWidth)
+    if light is None:
+        return float(pt[0]), float(pt[1]), 0.5
+    return light
+
+def fit_streak(contour, minLength, minRatio):
+    '''
+        Fits a line to a contour (cv2.fitLine) and returns a Streak if it is long and thin
+        * the ends are the extreme contour points along the line
+        * None if shorter than minLength (px) or less than minRatio times longer than wide
+    '''
+    pts = contour.reshape(-1, 2).astype(np.float32)
+    if len(pts) < 2:
+        return None
+    vx, vy, x0, y0 = cv2.fitLine(pts, cv2.DIST_L2, 0, 0.01, 0.01).ravel()
+    dx = pts[:, 0] - x0
+    dy = pts[:, 1] - y0
+    along = dx * vx + dy * vy
+    across = dy * vx - dx * vy
+    length = float(along.max() - along.min())
+    width = float(across.max() - across.min())
+    if length < minLength or length < minRatio * max(width, 1.0):
+        return None
+    head = (float(x0 + vx * along.max()), float(y0 + vy * along.max()))
+    tail = (float(x0 + vx * along.min()), float(y0 + vy * along.min()))
+    return Streak(head, tail, width)
+
+def to_pixel(pt):
+    ''' Rounds a sub-pixel point for drawing '''
+    return int(round(pt[0])), int(round(pt[1]))
+
+
+class Streak:
+    '''
+        A light smeared into a line over one exposure (a fast fireball)
+        * head and tail are the (x, y) ends. The head is where the light is at the end of the
+            exposure, see orient
+        * direction is the unit (x, y) vector from tail to head and length is in px
+        * measure converts both ends to PTU coordinates for the apparent angular velocity,
+            so a velocity is known from a single frame
+    '''
+
+    def __init__(self, head, tail, width):
+        self.head = head
+        self.tail = tail
+        self.width = width
+        self.length = math.hypot(head[0] - tail[0], head[1] - tail[1])
+        self.direction = ((head[0] - tail[0]) / self.length, (head[1] - tail[1]) / self.length)
+        self.headPos = None         # (pan, tilt) deg
+        self.tailPos = None
+        self.rate = None            # (pan, tilt) deg/s
+        self.angularSpeed = None    # deg/s
+
+    def orient(self, prevPt, center):
+        '''
+            Puts the head at the end away from the previous detection. Without one the head is
+            the end further from center, as fireballs fall towards the horizon (the lens edge)
+        '''
+        ref = prevPt
+        if ref is None:
+            ref = center
+        headDist = math.hypot(self.head[0] - ref[0], self.head[1] - ref[1])
+        tailDist = math.hypot(self.tail[0] - ref[0], self.tail[1] - ref[1])
+        if headDist < tailDist:
+            self.head, self.tail = self.tail, self.head
+            self.direction = (-self.direction[0], -self.direction[1])
+
+    def measure(self, transform, center, exposure):
+        ''' PTU positions of the ends and the angular velocity over an exposure (s) '''
+        ends = []
+        for pt in (self.tail, self.head):
+            dx = pt[0] - center[0]
+            dy = pt[1] - center[1]
+            ends.append(transform.calculate_pan_tilt(-math.degrees(math.atan2(dy, dx)), math.hypot(dx, dy)))
+        self.tailPos, self.headPos = ends
+        dPan = u.within_pi(self.headPos[0] - self.tailPos[0])
+        dTilt = self.headPos[1] - self.tailPos[1]
+        self.rate = (dPan / exposure, dTilt / exposure)
+
+        # Great circle angle between the ends
+        t1 = math.radians(self.tailPos[1])
+        t2 = math.radians(self.headPos[1])
+        cosAngle = math.sin(t1) * math.sin(t2) + math.cos(t1) * math.cos(t2) * math.cos(math.radians(dPan))
+        self.angularSpeed = math.degrees(math.acos(max(-1.0, min(1.0, cosAngle)))) / exposure
+
 
 class CVWindowEvent(object):
     '''
@@ -60,14 +242,25 @@ class MotionTracking(CVWindowEvent):
         * variables before the __init__ may be changed if desired
     '''
 
-    __wait__ = 0            # Number of seconds to wait before polling PTU
     __high__ = 255          # binary value of full intensity
     __low__ = 0             # binary value of no intensity
     __intensity__ = 20      # Minimum light intensity to track
     minArea = 2             # Minimum trackable area
     maxArea = 1500          # maximum trackable area
     threshold = 5           # minimum frame delta accepted as motion
+    adaptive = True         # threshold each pixel against its own noise (see NoiseMap)
+    noiseK = 4.0            # adaptive threshold in standard deviations
+    noiseAlpha = 0.01       # weight of each frame in the noise statistics
+    noiseEvery = 8          # frames between noise statistics updates
+    suppress = True         # mask out hot pixels and stars (see SuppressionMap)
     tillNextBg = 300        # Number of seconds until next background image is taken
+    slewDist = 10.0         # degrees from a new target before it is acquired with a slew
+    centroidRoi = 7         # half width of the sub-pixel centroid window (px)
+    streakArea = 20         # minimum area of a contour checked for a streak
+    streakLength = 15       # minimum streak length (px)
+    streakRatio = 4.0       # minimum streak length / width
+    exposure = 1.0 / 30.0   # time a streak is smeared over (s), the frame period
+    pyramid = 1             # 2 or 4 finds motion on a frame downsampled this much first
 
     def __init__(self, ownerName):
         super(MotionTracking, self).__init__(ownerName + ": Motion Tracking")
@@ -75,13 +268,28 @@ class MotionTracking(CVWindowEvent):
         self.bg = None
         self.setNewBg = False
         self.mask = None
-        self.prevPoll = 0
-
+        self.userMask = None
+        self.coarseBg = None            # downsampled background (see _get_pyramid_contours)
+        self.coarseMask = None
+        self.suppression = None
+        if self.suppress is True:
+            self.suppression = SuppressionMap()
+        self.buffers = FrameBuffers()   # reusable per frame images (sized on the first frame)
+        self.noise = None
+        self.coarseNoise = None         # noise of the downsampled frame when pyramid > 1
+        if self.adaptive is True:
+            self.noise = NoiseMap(self.noiseK, self.noiseAlpha, self.threshold, self.noiseEvery)
+            self.coarseNoise = NoiseMap(self.noiseK, self.noiseAlpha, self.threshold, self.noiseEvery)
 
         # Motion tracking vars
         self.PTU = None # type: PTUController
+        self.slew = None # type: SlewPlanner
+        self.reach = None # type: Reachability
+        self.payload = None # type: PayloadTracking
         self.targetPos = None
         self.targetPt = None
+        self.targetSigma = None         # sub-pixel uncertainty of targetPt (px)
+        self.streak = None              # Streak found this frame (targetPt is its head)
         self.curPos = None
         self.curPt = None
         self.marker = (175, 415)
@@ -93,41 +301,60 @@ class MotionTracking(CVWindowEvent):
     def run(self, img):
         isTracking = False
         if img is not None and self.PTU is not None and self.enabled is True:
-            img = cv2.flip(img, 0)
+            img = cv2.flip(img, 0, dst=self.buffers.get("flip", img.shape))
+
+            # Long term statistics for hot pixels and stars. The mask is recompiled when rebuilt
+            if self.suppression is not None:
+                self.suppression.add(img)
+                if self.suppression.take() is not None:
+                    self._compile_mask()
+
             if self.bg is None or self.setNewBg is True:
-                # Save a background image
-                self.bg = img
+                # Save a background image (copied as the flip buffer is reused)
+                self.bg = self.buffers.get("bg", img.shape)
+                np.copyto(self.bg, img)
+                self.coarseBg = None
                 self.setNewBg = False
                 self.newbgTime = time.time() + self.tillNextBg
             else:
-                # Apply mask
-                img = self._apply_mask(img)
-
                 # Convert image to color (for display only)
-                imgCol = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-
-                # Get motion delta
-                frameDelta = self._get_motion_delta(img, self.bg)
+                imgCol = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR, dst=self.buffers.get("color", img.shape + (3,)))
 
-                # Get contours of motion
-                contours = self._get_contours(frameDelta)
+                if self.pyramid > 1:
+                    # Coarse to fine detection (the mask is applied within this step)
+                    t = profiler.start()
+                    contours = self._get_pyramid_contours(img, self.bg)
+                    profiler.stop("_get_pyramid_contours", t)
+                else:
+                    # Get motion delta (the mask is applied within this step)
+                    t = profiler.start()
+                    frameDelta = self._get_motion_delta(img, self.bg)
+                    profiler.stop("_get_motion_delta", t)
 
-                # Process contours to get target pixels point
-                self.targetPt = self._get_target_pt(img, contours, self.targetPt)
+                    # Get contours of motion
+                    t = profiler.start()
+                    contours = self._get_contours(frameDelta)
+                    profiler.stop("_get_contours", t)
 
                 # Get image parameters
                 dims = img.shape                        # width and height of image
                 center = (dims[0] / 2, dims[1] / 2)     # center of the image
 
+                # Pixels the PTU can reach (computed once per image size)
+                if self.reach is not None:
+                    self.reach.image_map(dims, center)
+
+                # Process contours to get target pixels point
+                prevPt = self.targetPt
+                t = profiler.start()
+                self.targetPt = self._get_target_pt(img, contours, self.targetPt)
+                profiler.stop("_get_target_pt", t)
+
                 imgCol = self._draw_ptu_limits(imgCol, center)
 
-                # Get current PTU coordinates (Pan, tilt, pSpeed, tSpeed)
-                pp = 0
-                tp = 0
-                if time.time() - self.prevPoll > self.__wait__:
-                    self.prevPoll = time.time()
-                    pp, tp, ps, ts = self.PTU.get_pos_and_inst_speed_deg()
-                    self.curPos = (pp, tp)
+                # Get current PTU coordinates (Pan, tilt, pSpeed, tSpeed). Estimated between polls
+                pp, tp, ps, ts = self.PTU.get_pos_estimate_deg()
+                self.curPos = (pp, tp)
 
                 curAngle = self.PTU.transform.pan_deg_to_angle(pp)
                 curRad = self.PTU.transform.tilt_deg_to_radius(tp)
@@ -146,18 +373,60 @@ class MotionTracking(CVWindowEvent):
                     radius = self.calculate_radius(self.targetPt, center)
 
 
-                    # Get desired pan, tilt, pSpeed and tSpeed from prediction algorithm
-                    pan, tilt, pSpeed, tSpeed = self.PTU.transform.predict_pos_from_point(angle, radius, pp, tp)
-                    self.targetPos = (pan, tilt)
+                    # The payload loop drives the PTU once it has the target (see PayloadTracking)
+                    handedOver = self.payload is not None and self.payload.locked is True
+                    if handedOver is True and self.slew is not None:
+                        self.slew.cancel()
+
+                    # Acquire a new target far from the PTU with a time optimal slew (see SlewPlanner)
+                    # Fine tracking takes over once the slew is finished
+                    if handedOver is False and self.slew is not None and self.targetPos is None and \
+                            self.slew.target is None:
+                        instPos = self.PTU.transform.calculate_pan_tilt(angle, radius)
+                        if self.reach is not None:
+                            instPos = self.reach.plan(self.curPos, instPos)
+                        if instPos is not None and \
+                                max(abs(instPos[0] - pp), abs(instPos[1] - tp)) > self.slewDist:
+                            self.slew.start(self.curPos, instPos)
+                            self.PTU.transform.prevInstPos = None
+
+                    # A streak gives the velocity within a frame. Its tail is where the light was
+                    # an exposure ago, which the prediction extrapolates from (see Streak.measure)
+                    if self.streak is not None:
+                        self.streak.measure(self.PTU.transform, center, self.exposure)
+                        self.PTU.transform.prevInstPos = self.streak.tailPos
+                        cv2.line(imgCol, to_pixel(self.streak.tail), to_pixel(self.streak.head), __red__, 1)
+
+                    if handedOver is True:
+                        pan, tilt = self.curPos
+                        pSpeed, tSpeed = ps, ts
+                        self.targetPos = self.curPos
+                    elif self.slew is not None and self.slew.is_slewing(self.curPos):
+                        # Leave the PTU to finish the slew
+                        pan, tilt = self.slew.target
+                        pSpeed, tSpeed = ps, ts
+                        self.targetPos = (pan, tilt)
+                    else:
+                        # Motion within the centroid uncertainty is noise, which extrapolating would double
+                        # Aim at the measured point instead
+                        if self._is_jitter(prevPt) is True:
+                            self.PTU.transform.prevInstPos = None
+
+                        # Get desired pan, tilt, pSpeed and tSpeed from prediction algorithm
+                        t = profiler.start()
+                        pan, tilt, pSpeed, tSpeed = self.PTU.transform.predict_pos_from_point(angle, radius, pp, tp)
+                        profiler.stop("predict_pos_from_point", t)
+                        pan, tilt, pSpeed, tSpeed = self._legal_pos(pan, tilt, pSpeed, tSpeed)
+                        self.targetPos = (pan, tilt)
+
+                        # Apply positions and speeds to PTU
+                        self.PTU.set_pan_speed_deg(pSpeed)
+                        self.PTU.set_tilt_speed_deg(tSpeed)
+                        self.PTU.set_pan_deg(self.targetPos[0])
+                        self.PTU.set_tilt_deg(self.targetPos[1])
 
                     # Draw target point
-                    cv2.circle(imgCol, self.targetPt, 1, __red__, thickness=3)
-
-                    # Apply positions and speeds to PTU
-                    self.PTU.set_pan_speed_deg(pSpeed)
-                    self.PTU.set_tilt_speed_deg(tSpeed)
-                    self.PTU.set_pan_deg(self.targetPos[0])
-                    self.PTU.set_tilt_deg(self.targetPos[1])
+                    cv2.circle(imgCol, to_pixel(self.targetPt), 1, __red__, thickness=3)
 
                     # Draw points
                     #imgCol = self._draw_points(imgCol)
@@ -173,12 +442,17 @@ class MotionTracking(CVWindowEvent):
                     cv2.putText(imgCol, string4, (10, dims[1] - 50), self.font, 0.5, __green__, 1)
                     cv2.putText(imgCol, string2, (10, dims[1] - 30), self.font, 0.5, __green__, 1)
                     cv2.putText(imgCol, string3, (10, dims[1] - 10), self.font, 0.5, __green__, 1)
+                elif self.payload is not None and self.payload.locked is True:
+                    # Lost in the wide angle but still held by the payload loop
+                    self.targetPos = self.curPos
                 else:
                     self.targetPos = None
 
 
                 # Display image
+                t = profiler.start()
                 cv2.imshow(self.winName, imgCol)
+                profiler.stop("display", t)
 
                 # Update background to previous frame
                 #self.bg = img
@@ -199,18 +473,44 @@ class MotionTracking(CVWindowEvent):
     def set_thresh_bound(self, val):
         if u.between(self.lowValue, val, self.highValue):
             self.threshold = int(val)
+            if self.noise is not None:
+                self.noise.floor = self.threshold
+                self.coarseNoise.floor = self.threshold
 
     def assign(self, args):
         if args is not None:
             self.PTU = args[0]
+            self.slew = SlewPlanner(self.PTU)
+            self.reach = Reachability(self.PTU)
 
+    # Compile the mask once. White is tracked, black is ignored
     def set_mask(self, mask):
-        self.mask = cv2.bitwise_not(mask)
+        self.userMask = mask
+        self._compile_mask()
+
+    # Compile the user mask merged with the hot pixel and star suppression (see SuppressionMap)
+    def _compile_mask(self):
+        mask = self.userMask
+        if self.suppression is not None and self.suppression.mask is not None:
+            if mask is None:
+                mask = self.suppression.mask
+            elif mask.shape == self.suppression.mask.shape:
+                mask = cv2.bitwise_and(mask, self.suppression.mask)
+        if mask is not None:
+            self.mask = CompiledMask(mask)
+        else:
+            self.mask = None
+        self.coarseBg = None
 
-    def _apply_mask(self, img):
-        if self.mask is not None:
-           return cv2.subtract(img, self.mask)
-        return img
+    # Hand fine tracking over to a payload camera loop (see PayloadTracking)
+    def set_payload(self, payload):
+        self.payload = payload
+        if payload is not None:
+            payload.wide = self
+
+    # Number of frame buffers allocated so far. This should not grow once running
+    def get_allocations(self):
+        return self.buffers.allocations
 
     # Return the frame delta
     def _get_motion_delta(self, cur, prev):
@@ -218,34 +518,130 @@ class MotionTracking(CVWindowEvent):
         #cv2.GaussianBlur(cur, (21, 21), 0)
 
         # Get frame delta for positive gradient (dark to light events)
-        frameDelta = cv2.subtract(cur, prev)
-
-        # Create a binary threshold image
-        ret, thresh = cv2.threshold(frameDelta, self.threshold, self.__high__, self.__low__)
+        # With a mask only the active region is subtracted, masked in the same pass
+        if self.mask is not None:
+            frameDelta = self.mask.subtract(cur, prev)
+        else:
+            frameDelta = cv2.subtract(cur, prev, dst=self.buffers.get("delta", cur.shape))
+
+        # Create a binary threshold image (in place over the delta)
+        # Adaptive thresholds are k sigma of each pixel's own noise, never below threshold
+        if self.noise is not None:
+            region = cur
+            if self.mask is not None:
+                region = self.mask.crop(cur)
+            thresh = self.noise.apply(region, frameDelta)
+        else:
+            ret, thresh = cv2.threshold(frameDelta, self.threshold, self.__high__, self.__low__, dst=frameDelta)
 
         return thresh
 
     # get motion contours for a thresholded image
     def _get_contours(self, thresh):
+        # Offset contours from the masked region back to full image coordinates
+        offset = (0, 0)
+        if self.mask is not None:
+            offset = self.mask.offset
+
         # Get contours of the image
-        temp, contours, hierarchy = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        temp, contours, hierarchy = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE,
+                                                     offset=offset)
 
         return contours
 
+    # Coarse to fine contours. Motion is found on a frame area averaged down by pyramid and only
+    # the candidate regions are subtracted, thresholded and contoured again at full resolution
+    # Adaptive thresholds only keep noise statistics for the downsampled frame (coarseNoise). The
+    # candidate regions are thresholded against its levels scaled up to full resolution
+    # A single pixel light is diluted by the averaging, so very faint points need pyramid = 1
+    def _get_pyramid_contours(self, cur, bg):
+        scale = self.pyramid
+        offset = (0, 0)
+        roiMask = None
+        if self.mask is not None:
+            cur = self.mask.crop(cur)
+            bg = self.mask.crop(bg)
+            offset = self.mask.offset
+            if self.mask.full is False:
+                roiMask = self.mask.roiMask
+        h, w = cur.shape[:2]
+        size = (max(w // scale, 1), max(h // scale, 1))
+
+        # Coarse delta and threshold. The background and mask are downsampled once
+        small = cv2.resize(cur, size, dst=self.buffers.get("coarse", (size[1], size[0])),
+                           interpolation=cv2.INTER_AREA)
+        if self.coarseBg is None or self.coarseBg.shape != small.shape:
+            self.coarseBg = cv2.resize(bg, size, interpolation=cv2.INTER_AREA)
+            self.coarseMask = None
+            if roiMask is not None:
+                self.coarseMask = cv2.resize(roiMask, size, interpolation=cv2.INTER_NEAREST)
+            # Masked pixels are never written so must not keep values from an older mask
+            self.buffers.get("coarseDelta", small.shape).fill(0)
+        delta = cv2.subtract(small, self.coarseBg, dst=self.buffers.get("coarseDelta", small.shape),
+                             mask=self.coarseMask)
+        if self.coarseNoise is not None:
+            self.coarseNoise.scale = scale
+            self.coarseNoise.prepare(small, cur.shape)
+            thresh = self.coarseNoise.apply(small, delta)
+        else:
+            ret, thresh = cv2.threshold(delta, self.threshold, self.__high__, self.__low__, dst=delta)
+        temp, coarse, hierarchy = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        # Refine each candidate at full resolution. Regions are thresholded in place in a
+        # reused full size buffer
+        motion = self.buffers.get("fineDelta", cur.shape)
+        contours = []
+        for c in coarse:
+            x, y, cw, ch = cv2.boundingRect(c)
+            x, y, cw, ch = clip_roi(((x - 1) * scale, (y - 1) * scale, (cw + 2) * scale, (ch + 2) * scale), cur.shape)
+            if cw == 0 or ch == 0:
+                continue
+            roi = (slice(y, y + ch), slice(x, x + cw))
+            mask = None
+            if roiMask is not None:
+                mask = roiMask[roi]
+            fine = motion[roi]
+            if mask is not None:
+                # Masked pixels are not written by the subtract
+                fine.fill(0)
+            cv2.subtract(cur[roi], bg[roi], dst=fine, mask=mask)
+            if self.coarseNoise is not None:
+                self.coarseNoise.threshold_fine(fine, dst=fine, roi=roi)
+            else:
+                cv2.threshold(fine, self.threshold, self.__high__, self.__low__, dst=fine)
+            temp, found, hierarchy = cv2.findContours(fine, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE,
+                                                      offset=(offset[0] + x, offset[1] + y))
+            contours.extend(found)
+        return contours
+
     # Determine the point of motion with highest intensity
     def _get_target_pt(self, img, contours, prevTarget):
         target = None
+        streak = None
         if contours is not None:
             for c in contours:
                 largestArea = 0
                 # Check the area is greater than acceptable
                 area = cv2.contourArea(c)
+
+                # Long thin motion is a fast light smeared over the exposure. Keep the longest
+                if area > self.streakArea:
+                    found = fit_streak(c, self.streakLength, self.streakRatio)
+                    if found is not None:
+                        if streak is None or found.length > streak.length:
+                            streak = found
+                        continue
+
                 if self.minArea < area < self.maxArea:
                     M = cv2.moments(c)
                     if M["m00"] is not 0:
                         cX = int(M["m10"] / M["m00"])
                         cY = int(M["m01"] / M["m00"])
 
+                        # Ignore motion the PTU can not reach
+                        if self.reach is not None and self.reach.is_reachable_pt((cX, cY)) is False:
+                            continue
+
                         # Get the largest area found
                         # Will add closest instead later to prevent movement
                         if area > largestArea:
@@ -257,8 +653,45 @@ class MotionTracking(CVWindowEvent):
                 target = None
         else:
             target = None
+
+        # A streak takes priority and is tracked from its head
+        self.streak = None
+        if streak is not None:
+            streak.orient(prevTarget, (img.shape[0] / 2, img.shape[1] / 2))
+            if self.reach is None or self.reach.is_reachable_pt(streak.head) is True:
+                self.streak = streak
+                self.targetSigma = streak.width / 2.0
+                return streak.head
+
+        # Refine to a sub-pixel centroid of the light above the background
+        self.targetSigma = None
+        if target is not None:
+            light = centroid(img, target, self.centroidRoi, self.bg)
+            if light is not None:
+                target = (light[0], light[1])
+                self.targetSigma = light[2]
         return target
 
+    # True if the target moved less than its uncertainty (targetSigma) since prevPt
+    # A streak is a measured velocity and is never jitter
+    def _is_jitter(self, prevPt):
+        if self.targetSigma is None or self.streak is not None or prevPt is None:
+            return False
+        return math.hypot(self.targetPt[0] - prevPt[0], self.targetPt[1] - prevPt[1]) < self.targetSigma
+
+    # Shortest legal pose for a predicted position (see Reachability)
+    # Predictions in the dead zone are held at the limits. A pose flipped over the top has its
+    # speeds worked out again for the flipped move
+    def _legal_pos(self, pan, tilt, pSpeed, tSpeed):
+        if self.reach is None:
+            return pan, tilt, pSpeed, tSpeed
+        pos = self.reach.plan(self.curPos, (pan, tilt))
+        if pos is None:
+            pos = self.reach.clamp((pan, tilt))
+        elif abs(pos[1] - tilt) > 1e-6:
+            pSpeed, tSpeed = self.PTU.transform.speed_to_pos(pos, self.curPos)
+        return pos[0], pos[1], pSpeed, tSpeed
+
     # Draw PTU limits on image (this is only to convey information to the user
     def _draw_ptu_limits(self, imgCol, center):
         maxRadius = self.PTU.transform.camera_phi_to_radius(90.0 - self.PTU.tiltRangeDeg[0])
@@ -307,6 +740,101 @@ class MotionTracking(CVWindowEvent):
         # Display information on image
 
 
+class PayloadTracking(CVWindowEvent):
+    '''
+        Fine tracking from the payload camera, the second loop of the dual loop tracker
+        * MotionTracking acquires the target coarsely from the wide angle. Once a blob appears in
+            the payload frame this loop locks on and drives the PTU to keep it on the crosshair
+            (image center), while MotionTracking stops sending commands
+        * while locked only an ROI about the last centroid is searched (see locate_light) so the
+            loop keeps up with the payload frame rate. The whole frame is only searched while
+            the wide loop is tracking something to hand over
+        * after __lost_frames__ frames without the target the lock is dropped and the wide
+            loop takes over again
+        * the payload plate scale and axis directions come from the PTU's Tranform
+    '''
+
+    __gain__ = 0.5              # fraction of the measured offset corrected each frame
+    __roi__ = 40                # half width of the search region while locked (px)
+    __lost_frames__ = 3         # frames without the target before reverting to the wide loop
+    threshBound = 30            # find_light threshold and minimum area
+    minArea = 4
+
+    def __init__(self, ownerName):
+        super(PayloadTracking, self).__init__(ownerName + ": Payload Tracking")
+        self.PTU = None # type: PTUController
+        self.wide = None # type: MotionTracking
+        self.pt = None
+        self.locked = False
+        self.missed = 0
+        self.error = None           # last (pan, tilt) offset from the crosshair (deg)
+        self.sigma = None           # sub-pixel uncertainty of pt (px)
+
+    def assign(self, args):
+        if args is not None:
+            self.PTU = args[0]
+
+    def run(self, img):
+        '''
+            Centres the target in a payload frame
+            * returns the (pan, tilt) offset in degrees or None if the target was not seen
+        '''
+        if img is None or self.PTU is None or self.enabled is False:
+            return None
+
+        roi = None
+        if self.locked is True:
+            roi = (self.pt[0] - self.__roi__, self.pt[1] - self.__roi__, 2 * self.__roi__, 2 * self.__roi__)
+        elif self.wide is not None and self.wide.targetPos is None:
+            # Nothing to hand over
+            return None
+
+        t = profiler.start()
+        light = locate_light(img, self.threshBound, self.minArea, roi)
+        profiler.stop("payload_locate_light", t)
+        if light is None:
+            self.missed += 1
+            if self.locked is True and self.missed >= self.__lost_frames__:
+                self.unlock()
+            return None
+        pt = light[:2]
+        self.pt = pt
+        self.sigma = light[2]
+        self.missed = 0
+        self.locked = True
+
+        # Offset from the crosshair in degrees
+        pp, tp, ps, ts = self.PTU.get_pos_estimate_deg()
+        transform = self.PTU.transform
+        dx = (pt[0] - img.shape[1] / 2.0) * transform.__payload_deg_per_px__
+        dy = (pt[1] - img.shape[0] / 2.0) * transform.__payload_deg_per_px__
+        # Pan moves the target less when pointing up, and the other way once flipped over the top
+        c = math.cos(math.radians(tp))
+        c = math.copysign(max(abs(c), 0.2), c)
+        panErr = transform.__payload_pan_sign__ * dx / c
+        tiltErr = transform.__payload_tilt_sign__ * dy
+        self.error = (panErr, tiltErr)
+
+        # Speeds as the wide loop's prediction, bounded by the transform's limits
+        pSpeed = min(max(abs(panErr) * transform.__speed_delta_factor__, transform.__min_pan_speed__),
+                     transform.__max_pan_speed__)
+        tSpeed = min(max(abs(tiltErr) * transform.__speed_delta_factor__, transform.__min_tilt_speed__),
+                     transform.__max_tilt_speed__)
+        self.PTU.set_pan_speed_deg(pSpeed)
+        self.PTU.set_tilt_speed_deg(tSpeed)
+        self.PTU.set_pan_deg(pp + self.__gain__ * panErr)
+        self.PTU.set_tilt_deg(tp + self.__gain__ * tiltErr)
+        return self.error
+
+    def unlock(self):
+        ''' Hands control back to the wide loop, which starts a fresh prediction '''
+        self.locked = False
+        self.pt = None
+        self.error = None
+        if self.PTU is not None:
+            self.PTU.transform.prevInstPos = None
+
+
 class DisplayFeed(CVWindowEvent):
     ''' Displays an image '''
     def __init__(self, ownerName):
@@ -316,7 +844,9 @@ class DisplayFeed(CVWindowEvent):
     def run(self, img):
         if img is not None and self.enabled is True:
             mg = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+            t = profiler.start()
             cv2.imshow(self.winName, img)
+            profiler.stop("display", t)
             return img
 
 
@@ -548,24 +1078,26 @@ class DisplayMotionBasic(CVWindowEvent):
                 self.bg = img
                 self.setNewBg = False
             else:
-                # Apply mask
-                if self.mask is not None:
-                    img = cv2.subtract(img, self.mask)
-
                 # Convert image to color (for display only)
                 imgCol = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
 
                 # Apply Gaussian blur (this is probably too slow)
                 cv2.GaussianBlur(img, (21, 21), 0)
 
-                # Get frame delta
-                frameDelta = cv2.subtract(img, self.bg)
+                # Get frame delta (masked in the same pass over the active region only)
+                offset = (0, 0)
+                if self.mask is not None:
+                    frameDelta = self.mask.subtract(img, self.bg)
+                    offset = self.mask.offset
+                else:
+                    frameDelta = cv2.subtract(img, self.bg)
 
                 # Create a binary image (this may not be needed
                 ret, thresh = cv2.threshold(frameDelta, self.threshold, 255, 0)
 
                 # Get contours of the image
-                temp, contours, hierarchy = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+                temp, contours, hierarchy = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE,
+                                                             offset=offset)
 
                 # Process contours
                 if contours is not None:
@@ -604,8 +1136,12 @@ class DisplayMotionBasic(CVWindowEvent):
         if u.between(self.lowValue, val, self.highValue):
             self.threshold = int(val)
 
+    # Compile the mask once. This mask is subtracted so white is ignored
     def set_mask(self, mask):
-        self.mask = mask
+        if mask is not None:
+            self.mask = CompiledMask(cv2.bitwise_not(mask))
+        else:
+            self.mask = None
 
 # A more complex motion tracking program (illustrates points)
 class PlotMotion(CVWindowEvent):
@@ -792,8 +1328,6 @@ class MotionCalibration(CVWindowEvent):
 '''
 class SpeedControlledMotion(CVWindowEvent):
 
-    __wait__ = 0
-
     def __init__(self, ownerName):
         super(SpeedControlledMotion, self).__init__(ownerName + ": Speed control")
         self.PTU = None # type: PTUController
@@ -804,8 +1338,6 @@ class SpeedControlledMotion(CVWindowEvent):
         self.curPos = None      # current position in deg
         self.targetPos = None   # target position in deg
 
-        self.curTime = 0.0
-
         self.font = cv2.FONT_HERSHEY_SIMPLEX
         self.marker = (175, 415)  # Marker position (the actual numbers do not matter as they are set with right click)
 
@@ -862,14 +1394,13 @@ class SpeedControlledMotion(CVWindowEvent):
                 # Store target and current positions
                 self.targetPos = (pan, tilt)
 
-                # Every "wait" seconds, get the PTU coordinates
-                if time.time() - self.curTime > self.__wait__:
-                    self.curTime = time.time()
-                    self.curPos = (self.PTU.get_pan_deg(), self.PTU.get_tilt_deg())
-                    # The negative 1 is used because y axis in normal math is up and in images is down
-                    comp = cmath.rect(self.PTU.transform.tilt_deg_to_radius(self.curPos[1]),
-                                      -1.0 * math.radians(self.PTU.transform.pan_deg_to_angle(self.curPos[0])))
-                    self.curPt = (int(comp.real) + center[0], int(comp.imag) + center[1])
+                # Get the PTU coordinates (estimated between polls)
+                curPan, curTilt, ps, ts = self.PTU.get_pos_estimate_deg()
+                self.curPos = (curPan, curTilt)
+                # The negative 1 is used because y axis in normal math is up and in images is down
+                comp = cmath.rect(self.PTU.transform.tilt_deg_to_radius(self.curPos[1]),
+                                  -1.0 * math.radians(self.PTU.transform.pan_deg_to_angle(self.curPos[0])))
+                self.curPt = (int(comp.real) + center[0], int(comp.imag) + center[1])
 
                 # Determine velocity vector
                 vel = [self.targetPos[0] - self.curPos[0], self.targetPos[1] - self.curPos[1]]
@@ -977,6 +1508,7 @@ class CenterLight(CVWindowEvent):
         self.pt = None
         self.threshBound = 30
         self.minArea = 6
+        self.sigma = None       # sub-pixel uncertainty of pt (px)
 
     def close(self):
         if self.enabled is False:
@@ -988,39 +1520,22 @@ class CenterLight(CVWindowEvent):
             self.contour(img)
 
     def contour(self, img):
-        # Threshold image
-        ret, thresh = cv2.threshold(img, self.threshBound, 255, 0)
+        # Sub-pixel centroid of the largest blob
+        light = locate_light(img, self.threshBound, self.minArea)
+        if light is None:
+            self.pt = (0, 0)
+            self.sigma = None
+        else:
+            self.pt = light[:2]
+            self.sigma = light[2]
 
         # Convert image to color
         imgCol = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
 
-        # Get contours of the image
-        temp, contours, hierarchy = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-
-        # Process contours
-        if contours is not None:
-            prevArea = self.minArea
-            found1 = False
-            for c in contours:
-                # check for largest area point
-                cArea = cv2.contourArea(c)
-                if cArea > prevArea:
-                    prevArea = cArea
-                    found1 = True
-                    M = cv2.moments(c)
-                    if M["m00"] is not 0:
-                        cX = int(M["m10"] / M["m00"])
-                        cY = int(M["m01"] / M["m00"])
-                        self.pt = (cX, cY)
-            if found1 is False:
-                self.pt = (0, 0)
-        else:
-            self.pt = (0, 0)
-
         if self.pt is not (0, 0):
             # Draw contour and point for largest area
             # cv2.drawContours(imgCol, [c], -1, __red__, 2)
-            cv2.circle(imgCol, self.pt, 1, __blue__, 6)
+            cv2.circle(imgCol, to_pixel(self.pt), 1, __blue__, 6)
 
         cv2.imshow(self.winName, imgCol)
 
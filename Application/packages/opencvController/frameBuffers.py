@@ -0,0 +1,28 @@
+import numpy as np
+
+
+class FrameBuffers:
+    '''
+        A named set of reusable image buffers for per frame processing
+
+        * buffers are allocated the first time they are requested and reused after
+        * a buffer is only reallocated if the requested shape or type changes
+        * allocations counts every allocation so a steady state loop should not increase it
+    '''
+
+    def __init__(self):
+        self.bufs = {}
+        self.allocations = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        ''' Returns the buffer called name, allocating it if it does not match shape and dtype '''
+        buf = self.bufs.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = np.zeros(shape, dtype)
+            self.bufs[name] = buf
+            self.allocations += 1
+        return buf
+
+    def clear(self):
+        ''' Releases all buffers. The allocation count is kept '''
+        self.bufs = {}
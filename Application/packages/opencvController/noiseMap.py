@@ -0,0 +1,130 @@
+import cv2
+import numpy as np
+
+
+class NoiseMap:
+    '''
+        Per pixel temporal noise of the camera for adaptive motion thresholds
+
+        * a running (exponentially weighted) mean and variance of every pixel is kept in place
+        * a delta pixel is motion if it is above k sigma of that pixel, and never below floor
+        * pixels found as motion are left out of the update so a target does not raise its own noise
+        * the noise changes slowly, so only every nth frame is added to the statistics (with the
+            weight of n frames) and the levels are rebuilt then. Other frames only threshold
+        * all work is done in float32 buffers allocated on the first frame and reused
+        * frames and deltas must cover the same region (the compiled mask crop if one is used)
+        * for frames downsampled by scale (area averaged), fineLevels are the levels for the full
+            resolution deltas. Averaging scale x scale pixels divides the noise by scale, so
+            they are scale times the levels, upscaled when the levels are rebuilt
+    '''
+
+    def __init__(self, k=4.0, alpha=0.01, floor=5, every=8, scale=1):
+        self.k = k              # threshold in standard deviations
+        self.alpha = alpha      # weight of each new frame in the running statistics
+        self.floor = floor      # lowest threshold (the global threshold)
+        self.every = every      # frames between statistics updates
+        self.scale = scale      # downsampling of the frames (see fineLevels)
+        self.fineShape = None   # full resolution shape, if fineLevels are kept
+        self.fineLevels = None
+        self.mean = None
+        self.var = None
+        self.levels = None      # uint8 threshold of each pixel
+        self.count = 0          # frames seen
+        self.frames = 0         # frames added to the statistics
+
+    def _allocate(self, img):
+        shape = img.shape
+        self.mean = img.astype(np.float32)
+        # Start at the global threshold until the noise is learnt
+        self.var = np.full(shape, (float(self.floor) / self.k) ** 2, np.float32)
+        self.diff = np.empty(shape, np.float32)
+        self.quiet = np.empty(shape, np.uint8)
+        self.levels = np.empty(shape, np.uint8)
+        if self.fineShape is not None:
+            self.scaled = np.empty(shape, np.uint8)
+            self.fineLevels = np.empty(self.fineShape, np.uint8)
+        self._update_levels()
+
+    def _update_levels(self):
+        # k sigma, limited to [floor, 255] and truncated to the uint8 the delta must exceed
+        cv2.sqrt(self.var, dst=self.diff)
+        cv2.multiply(self.diff, self.k, dst=self.diff)
+        if self.fineLevels is not None:
+            cv2.convertScaleAbs(self.diff, dst=self.scaled, alpha=self.scale)
+            np.maximum(self.scaled, self.floor, out=self.scaled)
+            cv2.resize(self.scaled, (self.fineShape[1], self.fineShape[0]), dst=self.fineLevels,
+                       interpolation=cv2.INTER_NEAREST)
+        np.clip(self.diff, self.floor, 255, out=self.diff)
+        np.copyto(self.levels, self.diff, casting="unsafe")
+
+    def prepare(self, img, fineShape=None):
+        '''
+            Allocates the statistics if img is the first frame or a new shape
+            * fineShape is the full resolution shape when fineLevels are wanted
+        '''
+        if self.mean is None or self.mean.shape != img.shape or \
+                (fineShape is not None and fineShape != self.fineShape):
+            if fineShape is not None:
+                self.fineShape = fineShape
+            self._allocate(img)
+
+    def threshold(self, delta, dst=None, roi=None):
+        '''
+            Binary (255) image of the delta pixels above their noise threshold
+            * roi is (rows, cols) slices if delta only covers part of the frame
+        '''
+        levels = self.levels
+        if roi is not None:
+            levels = levels[roi]
+        return cv2.compare(delta, levels, cv2.CMP_GT, dst=dst)
+
+    def threshold_fine(self, delta, dst=None, roi=None):
+        ''' threshold for a full resolution delta against fineLevels (see prepare) '''
+        levels = self.fineLevels
+        if roi is not None:
+            levels = levels[roi]
+        return cv2.compare(delta, levels, cv2.CMP_GT, dst=dst)
+
+    def due(self):
+        ''' True if the next frame passed to update is added to the statistics '''
+        return self.count % self.every == 0
+
+    def update(self, img, motion=None):
+        ''' Adds the frame to the statistics if it is due. Pixels set in motion are skipped '''
+        due = self.due()
+        self.count += 1
+        if due is False:
+            return
+
+        # One update stands in for every frames, so it has their combined weight
+        weight = 1.0 - (1.0 - self.alpha) ** self.every
+        mask = None
+        if motion is not None:
+            mask = cv2.bitwise_not(motion, dst=self.quiet)
+
+        # Squared difference from the mean before the mean is moved (running variance)
+        cv2.subtract(img, self.mean, dst=self.diff, dtype=cv2.CV_32F)
+        cv2.multiply(self.diff, self.diff, dst=self.diff)
+        cv2.accumulateWeighted(self.diff, self.var, weight, mask=mask)
+        cv2.accumulateWeighted(img, self.mean, weight, mask=mask)
+        self._update_levels()
+        self.frames += 1
+
+    def apply(self, img, delta):
+        '''
+            Thresholds delta in place against the noise and then adds img to the statistics
+            * returns the binary delta
+        '''
+        self.prepare(img)
+        thresh = self.threshold(delta, dst=delta)
+        self.update(img, thresh)
+        return thresh
+
+    def reset(self):
+        ''' Forgets the statistics. They are rebuilt from the next frame '''
+        self.mean = None
+        self.var = None
+        self.levels = None
+        self.fineLevels = None
+        self.count = 0
+        self.frames = 0
@@ -0,0 +1,86 @@
+import threading
+import cv2
+import numpy as np
+
+from .. other import Utilities as u
+
+
+class SuppressionMap:
+    '''
+        A mask of hot pixels and stars built from long term frame statistics
+
+        * a frame is sampled every __interval__ seconds into a stack of the last __samples__
+        * each sample is the local maximum over __grow__ px (a dilation), so a star drifting
+            a few px over the stack stays on the same pixels
+        * once the stack is full, and then every __rebuild__ samples, a background thread takes
+            the per pixel median of the stack. Point sources standing __level__ above the
+            local background of the median (hot pixels and stars) are suppressed
+        * suppressed spots are grown by __grow__ px to cover star drift until the next build
+        * a moving light is in too few samples to reach the median so is never suppressed
+        * the mask is white where tracked and black where suppressed, as mask.png
+    '''
+
+    __interval__ = 10.0     # seconds between samples
+    __samples__ = 24        # frames in the stack (4 minutes)
+    __rebuild__ = 6         # samples between builds once the stack is full
+    __level__ = 15          # brightness above the local background that is suppressed
+    __background__ = 9      # median filter size of the local background (px, odd)
+    __grow__ = 3            # px added around each suppressed spot
+
+    def __init__(self):
+        self.stack = None
+        self.count = 0
+        self.sinceBuild = 0
+        self.nextTime = None
+        self.thread = None
+        self.lock = threading.Lock()
+        size = 2 * self.__grow__ + 1
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+        self.mask = None            # latest mask
+        self.new = False            # mask not yet taken
+        self.builds = 0
+        self.suppressed = 0         # suppressed pixels in the latest mask
+
+    def add(self, img):
+        ''' Samples the frame if one is due. Otherwise nothing is done '''
+        now = u.monotonic()
+        if self.nextTime is not None and now < self.nextTime:
+            return
+        self.nextTime = now + self.__interval__
+
+        if self.stack is None or self.stack.shape[1:] != img.shape:
+            self.stack = np.empty((self.__samples__,) + img.shape, np.uint8)
+            self.count = 0
+            self.sinceBuild = 0
+        cv2.dilate(img, self.kernel, dst=self.stack[self.count % self.__samples__])
+        self.count += 1
+        self.sinceBuild += 1
+
+        building = self.thread is not None and self.thread.isAlive()
+        if self.count >= self.__samples__ and self.sinceBuild >= self.__rebuild__ and building is False:
+            # The stack is not copied. A sample written during a build changes one frame of the median
+            self.sinceBuild = 0
+            self.thread = threading.Thread(target=self._build, args=(self.stack,))
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _build(self, stack):
+        median = np.median(stack, axis=0).astype(np.uint8)
+        local = cv2.medianBlur(median, self.__background__)
+        bright = cv2.subtract(median, local)
+        ret, suppress = cv2.threshold(bright, self.__level__, 255, cv2.THRESH_BINARY)
+        suppress = cv2.dilate(suppress, self.kernel)
+        mask = cv2.bitwise_not(suppress)
+        with self.lock:
+            self.mask = mask
+            self.new = True
+            self.builds += 1
+            self.suppressed = cv2.countNonZero(suppress)
+
+    def take(self):
+        ''' Returns a newly built mask once, otherwise None '''
+        with self.lock:
+            if self.new is False:
+                return None
+            self.new = False
+            return self.mask
@@ -0,0 +1,145 @@
+import math
+import json
+import threading
+import numpy as np
+
+import Utilities as u
+
+
+class Profiler:
+    '''
+        Always on timing of named processing stages
+
+        * each stage keeps a fixed size histogram of durations so memory never grows
+        * bins are logarithmic from minTime to maxTime seconds (binsPerDecade per factor of 10)
+        * durations use a monotonic clock so they are unaffected by system time changes
+        * percentiles are estimated from the histogram (accurate to one bin)
+        * stages can be recorded from several threads (e.g. CaptureThread). Stage creation
+            and updates are guarded by a lock
+
+        Usage:  t = profiler.start()
+                ... stage ...
+                profiler.stop("stage", t)
+    '''
+
+    __max_stages__ = 64     # maximum number of named stages
+
+    def __init__(self, minTime=1e-6, maxTime=10.0, binsPerDecade=10):
+        self.minTime = minTime
+        self.binsPerDecade = binsPerDecade
+        self.logMin = math.log10(minTime)
+        self.nBins = int(math.ceil((math.log10(maxTime) - self.logMin) * binsPerDecade)) + 1
+
+        # Upper edge of each bin in seconds (last bin holds everything above maxTime)
+        self.edges = 10.0 ** (self.logMin + (np.arange(self.nBins) + 1.0) / binsPerDecade)
+
+        self.names = []
+        self.index = {}
+        self.hist = np.zeros((self.__max_stages__, self.nBins), np.int64)
+        self.count = np.zeros(self.__max_stages__, np.int64)
+        self.total = np.zeros(self.__max_stages__, np.float64)
+        self.max = np.zeros(self.__max_stages__, np.float64)
+        self.last = np.zeros(self.__max_stages__, np.float64)
+        self.enabled = True
+        self.lock = threading.Lock()
+
+    def start(self):
+        ''' Returns a timestamp to be passed to stop '''
+        return u.monotonic()
+
+    def stop(self, name, start):
+        ''' Records the time since start against the named stage. Returns the duration in seconds '''
+        elapsed = u.monotonic() - start
+        self.record(name, elapsed)
+        return elapsed
+
+    def record(self, name, elapsed):
+        ''' Records a duration in seconds against the named stage '''
+        if self.enabled is False:
+            return
+        if elapsed > self.minTime:
+            b = int((math.log10(elapsed) - self.logMin) * self.binsPerDecade)
+            if b >= self.nBins:
+                b = self.nBins - 1
+        else:
+            b = 0
+
+        with self.lock:
+            i = self.index.get(name)
+            if i is None:
+                i = self._add_stage(name)
+                if i is None:
+                    return
+
+            self.hist[i, b] += 1
+            self.count[i] += 1
+            self.total[i] += elapsed
+            self.last[i] = elapsed
+            if elapsed > self.max[i]:
+                self.max[i] = elapsed
+
+    # Called with the lock held
+    def _add_stage(self, name):
+        if len(self.names) >= self.__max_stages__:
+            return None
+        self.index[name] = len(self.names)
+        self.names.append(name)
+        return self.index[name]
+
+    def reset(self):
+        ''' Clears all recorded durations (stage names are kept) '''
+        with self.lock:
+            self.hist[:] = 0
+            self.count[:] = 0
+            self.total[:] = 0
+            self.max[:] = 0
+            self.last[:] = 0
+
+    def percentile(self, name, p):
+        ''' Estimated p-th percentile of a stage in seconds (upper edge of the bin) '''
+        i = self.index.get(name)
+        if i is None or self.count[i] == 0:
+            return None
+        cum = np.cumsum(self.hist[i])
+        b = int(np.searchsorted(cum, p / 100.0 * self.count[i]))
+        return min(float(self.edges[b]), float(self.max[i]))
+
+    def summary(self):
+        ''' Returns {stage: {count, mean, last, max, p50, p90, p99}} with times in ms '''
+        ret = {}
+        for name in self.names:
+            i = self.index[name]
+            n = int(self.count[i])
+            if n == 0:
+                continue
+            ret[name] = {"count": n,
+                         "mean": 1000.0 * self.total[i] / n,
+                         "last": 1000.0 * self.last[i],
+                         "max": 1000.0 * self.max[i],
+                         "p50": 1000.0 * self.percentile(name, 50),
+                         "p90": 1000.0 * self.percentile(name, 90),
+                         "p99": 1000.0 * self.percentile(name, 99)}
+        return ret
+
+    def report(self):
+        ''' Returns a list of formatted strings (one per stage) for display '''
+        lines = ["{:<24}{:>8}{:>9}{:>9}{:>9}{:>9}".format("Stage", "Count", "Mean", "p50", "p99", "Max")]
+        summary = self.summary()
+        for name in self.names:
+            if name in summary:
+                s = summary[name]
+                lines.append("{:<24}{:>8}{:>9.3f}{:>9.3f}{:>9.3f}{:>9.3f}".format(
+                    name[:23], s["count"], s["mean"], s["p50"], s["p99"], s["max"]))
+        return lines
+
+    def dump(self, path):
+        ''' Saves the summary and raw histograms as json '''
+        data = {"summary": self.summary(),
+                "edges": self.edges.tolist(),
+                "histograms": dict((name, self.hist[self.index[name]].tolist()) for name in self.names)}
+        with open(path, "w") as fout:
+            json.dump(data, fout, indent=2, sort_keys=True)
+
+
+# Shared profiler for the processing loop
+profiler = Profiler()
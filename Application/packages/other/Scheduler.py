@@ -0,0 +1,88 @@
+import math
+import time
+
+import Utilities as u
+from Profiler import Profiler
+
+
+class Scheduler:
+    '''
+        Sleep based scheduler for timed commands and a fixed frame cadence
+
+        * epoch deadlines are converted to the monotonic clock once, so changes to the
+            system clock do not affect a running schedule
+        * frame n is due at origin + n * period so timing errors never accumulate
+        * frames that are missed by more than a period are skipped rather than bunched up
+        * the lateness of every wake up is kept (see stats)
+    '''
+
+    __spin__ = 0.002        # seconds before a deadline to stop sleeping and spin
+
+    def __init__(self, framePeriod=None):
+        self.offset = time.time() - u.monotonic()   # epoch - monotonic
+        self.framePeriod = framePeriod
+        self.frameOrigin = None
+        self.frameIndex = 0
+        self.skipped = 0
+        self.lateness = Profiler()
+
+    def to_monotonic(self, epoch):
+        return epoch - self.offset
+
+    def wait_until(self, deadline):
+        ''' Sleeps until the monotonic deadline. Returns how late the wake up was (s) '''
+        remaining = deadline - u.monotonic()
+        if remaining > self.__spin__:
+            time.sleep(remaining - self.__spin__)
+        while u.monotonic() < deadline:
+            pass
+        return u.monotonic() - deadline
+
+    def start_frames(self, epoch):
+        ''' Frames are due every framePeriod from the epoch time given '''
+        self.frameOrigin = self.to_monotonic(epoch)
+        self.frameIndex = 0
+
+    def next_frame(self):
+        ''' Monotonic deadline of the next frame or None if frames are not running '''
+        if self.framePeriod is None or self.frameOrigin is None:
+            return None
+        return self.frameOrigin + self.frameIndex * self.framePeriod
+
+    def _frame_done(self):
+        self.frameIndex += 1
+        # Skip any frames that are already more than a period late
+        behind = int(math.floor((u.monotonic() - self.frameOrigin) / self.framePeriod))
+        if behind > self.frameIndex:
+            self.skipped += behind - self.frameIndex
+            self.frameIndex = behind
+
+    def run(self, times, onCommand, onFrame=None):
+        '''
+            Calls onCommand(i) at each epoch time in times (in order, times <= 0 run immediately)
+            and onFrame() at the frame cadence in between
+        '''
+        for i in range(len(times)):
+            due = times[i]
+            deadline = None
+            if due > 0:
+                deadline = self.to_monotonic(due)
+
+            # Frames that fall before the command
+            if onFrame is not None and deadline is not None:
+                frame = self.next_frame()
+                while frame is not None and frame < deadline:
+                    self.lateness.record("frame", self.wait_until(frame))
+                    onFrame()
+                    self._frame_done()
+                    frame = self.next_frame()
+
+            if deadline is not None:
+                self.lateness.record("command", self.wait_until(deadline))
+            onCommand(i)
+
+    def stats(self):
+        ''' Lateness (ms) for commands and frames and the number of skipped frames '''
+        ret = self.lateness.summary()
+        ret["skippedFrames"] = self.skipped
+        return ret
@@ -1,6 +1,9 @@
 import usb
 import time
 import re
+import ctypes
+import ctypes.util
+import numpy as np
 
 def between(lower, val, upper):
     if lower < val < upper:
@@ -17,6 +20,28 @@ def within_pi(angle):
         angle += 360
     return angle
 
+# Vectorised within_pi for numpy arrays
+def within_pi_array(angle):
+    angle = np.mod(angle, 360.0)
+    return np.where(angle > 180, angle - 360.0, angle)
+
+# Monotonic clock in seconds. Unaffected by system clock changes (time.monotonic is python 3 only)
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    class _timespec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    __CLOCK_MONOTONIC__ = 1
+    __librt__ = ctypes.CDLL(ctypes.util.find_library("rt"), use_errno=True)
+    __clock_gettime__ = __librt__.clock_gettime
+    __clock_gettime__.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+    def monotonic():
+        t = _timespec()
+        __clock_gettime__(__CLOCK_MONOTONIC__, ctypes.byref(t))
+        return t.tv_sec + t.tv_nsec * 1e-9
+
 def reset_connection():
     print "Restarting connections ..."
     i = 0
@@ -0,0 +1,155 @@
+import csv
+import numpy as np
+
+# A calibration sample
+#   x, y        target in the wide angle image (flipped as in MotionTracking)
+#   cx, cy      wide angle image center
+#   pan, tilt   commanded PTU position (deg)
+#   px, py      target centroid in the payload image (px)
+#   pw, ph      payload image width and height
+__sample_dtype__ = np.dtype([(name, "<f8") for name in
+                             ["x", "y", "cx", "cy", "pan", "tilt", "px", "py", "pw", "ph"]])
+
+# Transform values fitted jointly to calculate_pan_tilt
+__fit_keys__ = ["markerFromNormal", "__phi_per_radius__", "__del_x__", "__del_y__", "__del_z__"]
+
+
+class CalibrationRecorder:
+    '''
+        Collects calibration samples during a sweep
+        * each sample ties a wide angle pixel to the PTU position that centers it on the payload
+        * samples are saved as csv so they can be fitted offline (see fit)
+    '''
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, pt, center, pan, tilt, payloadPt, payloadShape):
+        ''' Adds a sample. payloadShape is the (rows, cols) of the payload image '''
+        self.samples.append((pt[0], pt[1], center[0], center[1], pan, tilt,
+                             payloadPt[0], payloadPt[1], payloadShape[1], payloadShape[0]))
+
+    def clear(self):
+        self.samples = []
+
+    def to_array(self):
+        return np.array(self.samples, dtype=__sample_dtype__)
+
+    def save(self, path):
+        with open(path, "w") as fout:
+            writer = csv.writer(fout, delimiter=',')
+            writer.writerow(__sample_dtype__.names)
+            for sample in self.samples:
+                writer.writerow(sample)
+
+
+def load_samples(path):
+    ''' Reads samples saved by CalibrationRecorder.save '''
+    return np.atleast_1d(np.loadtxt(path, dtype=__sample_dtype__, delimiter=',', skiprows=1))
+
+
+def wrap(angle):
+    ''' Vectorised angle difference wrapped to +-180 '''
+    return np.mod(angle + 180.0, 360.0) - 180.0
+
+
+def wide_angles(samples):
+    ''' Angle (deg, as MotionTracking.calculate_angle) and radius of each sample in the wide angle image '''
+    dx = samples["x"] - samples["cx"]
+    dy = samples["y"] - samples["cy"]
+    return -np.degrees(np.arctan2(dy, dx)), np.hypot(dx, dy)
+
+
+def payload_pan_tilt(samples, transform):
+    ''' PTU position (deg) that would have centered the target on the payload '''
+    dx = (samples["px"] - samples["pw"] / 2.0) * transform.__payload_deg_per_px__
+    dy = (samples["py"] - samples["ph"] / 2.0) * transform.__payload_deg_per_px__
+    cosTilt = np.maximum(np.cos(np.radians(samples["tilt"])), 0.2)
+    pan = samples["pan"] + transform.__payload_pan_sign__ * dx / cosTilt
+    tilt = samples["tilt"] + transform.__payload_tilt_sign__ * dy
+    return wrap(pan), tilt
+
+
+def model(transform, values, alpha, radius):
+    '''
+        Vectorised Tranform.calculate_pan_tilt
+        * values overrides any of the transform's settings
+    '''
+    def get(name):
+        return values.get(name, getattr(transform, name))
+
+    rho = get("__rho__")
+    theta = np.radians(wrap(alpha - get("markerFromNormal")))
+    phi = np.radians(wrap(get("__phi_per_radius__") * radius))
+
+    POx = rho * np.cos(theta) * np.sin(phi) - get("__del_x__")
+    POy = rho * np.sin(theta) * np.sin(phi) - get("__del_y__")
+    POz = rho * np.cos(phi) - get("__del_z__")
+    POrho = np.sqrt(POx * POx + POy * POy + POz * POz)
+
+    pan = wrap(np.degrees(np.arctan2(POy, POx)) + transform.__markerFromPtu__ - transform.__payloadPanOffset__)
+    tilt = wrap(90.0 - np.degrees(np.arccos(POz / POrho)))
+    return pan, tilt
+
+
+def fit(samples, transform, keys=__fit_keys__, iterations=100):
+    '''
+        Fits the transform to the samples and applies the result to it
+        * the keys of calculate_pan_tilt are fitted jointly by damped Gauss-Newton
+            (Levenberg-Marquardt) on the pan and tilt residuals of every sample at once
+        * the static radius <-> tilt lines are fitted by linear least squares
+        * returns the fitted values with the rms error (deg) before and after
+    '''
+    alpha, radius = wide_angles(samples)
+    pan, tilt = payload_pan_tilt(samples, transform)
+
+    def residuals(p):
+        mPan, mTilt = model(transform, dict(zip(keys, p)), alpha, radius)
+        return np.concatenate((wrap(mPan - pan), mTilt - tilt))
+
+    p = np.array([getattr(transform, name) for name in keys], np.float64)
+    r = residuals(p)
+    cost = r.dot(r)
+    before = np.sqrt(cost / len(r))
+    damping = 1e-3
+    for i in range(iterations):
+        # Forward difference jacobian, one column per parameter
+        J = np.empty((len(r), len(p)))
+        for j in range(len(p)):
+            step = 1e-6 * max(abs(p[j]), 1.0)
+            dp = p.copy()
+            dp[j] += step
+            J[:, j] = (residuals(dp) - r) / step
+
+        A = J.T.dot(J)
+        g = J.T.dot(r)
+        delta = np.linalg.lstsq(A + damping * np.diag(np.diag(A) + 1e-12), -g, rcond=-1)[0]
+        new = p + delta
+        rNew = residuals(new)
+        costNew = rNew.dot(rNew)
+        if costNew < cost:
+            done = cost - costNew < 1e-12 * max(cost, 1e-12)
+            p, r, cost = new, rNew, costNew
+            damping /= 10.0
+            if done:
+                break
+        else:
+            damping *= 10.0
+            if damping > 1e12:
+                break
+
+    values = dict(zip(keys, p.tolist()))
+
+    # Static lines
+    if len(np.unique(radius)) > 1:
+        values["__tilt_per_radius__"], values["__tilt_at_center__"] = np.polyfit(radius, tilt, 1).tolist()
+        values["__radius_per_tilt__"], values["__radius_at_zero_tilt__"] = np.polyfit(tilt, radius, 1).tolist()
+
+    for name, value in values.items():
+        setattr(transform, name, value)
+    transform._update_derived()
+
+    values["rmsBefore"] = float(before)
+    values["rmsAfter"] = float(np.sqrt(cost / len(r)))
+    values["samples"] = len(samples)
+    return values
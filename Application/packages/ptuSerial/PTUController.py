@@ -1,9 +1,17 @@
 import time
+import os
+import json
 
 from Transform import Tranform
 from PTUSerial import PTUSerial
+from PTUEstimator import PTUEstimator
 from .. other import Utilities as u
 
+__cache_path__ = os.path.dirname(os.path.realpath(__file__)) + "/ptuCache.json"   # saved unit parameters
+__pan_accel__ = 2000        # unit default accelerations (counts/s^2)
+__tilt_accel__ = 2000
+__poll_rate__ = 2.0         # position polls per second when estimating
+__max_error__ = 0.5         # estimate error bound (deg) that forces a poll
 
 class PTUController:
 
@@ -15,11 +23,16 @@ class PTUController:
         is valid and not redundant
     '''
 
-    def __init__(self, port, baudrate):
-        # Serial object user for interfacing
-        self.PTU = PTUSerial(port=port, baudrate=baudrate)
+    def __init__(self, port, baudrate, maxBaud=None, useCache=True, pollRate=__poll_rate__, maxError=__max_error__):
+        # Serial object user for interfacing (maxBaud allows a faster rate to be negotiated)
+        self.PTU = PTUSerial(port=port, baudrate=baudrate, maxBaud=maxBaud, queryRes=not useCache)
         self.transform = Tranform()
 
+        # Position estimate between polls (see get_pos_estimate_deg)
+        self.estimator = PTUEstimator(self.PTU, __pan_accel__, __tilt_accel__, pollRate, maxError)
+        self.useCache = useCache
+        self.identity = None
+
         # Ranges
         self.panRange = [-3081, 3081]
         self.panRangeDeg = [-158.00, 158.00]
@@ -48,17 +61,72 @@ class PTUController:
         self.setup()
 
     # Get all relevant parameters from the PTU
+    # Fixed unit parameters come from the cache if it matches the connected unit
     def setup(self):
-        self.get_pan_range()
-        self.get_tilt_range()
-        self.get_pan_range()
-        self.get_tilt_speed()
-        self.get_pan()
-        self.get_tilt()
+        if self.useCache is False or self.load_cache() is False:
+            self.refresh_parameters()
+            if self.useCache is True:
+                self.save_cache()
+        self.get_pos()
         self.get_pan_speed()
         self.get_tilt_speed()
 
+    # Query the fixed unit parameters (resolutions and ranges)
+    def refresh_parameters(self):
+        if self.PTU.panRes is None:
+            self.PTU.get_pan_res()
+        if self.PTU.tiltRes is None:
+            self.PTU.get_tilt_res()
+        self.get_pan_range()
+        self.get_tilt_range()
+
+    # Load unit parameters saved for this unit. False if there is no valid entry
+    def load_cache(self):
+        self.identity = self.PTU.get_identity()
+        if self.identity is None:
+            return False
+        try:
+            with open(__cache_path__) as fin:
+                entry = json.load(fin).get(self.identity)
+        except (IOError, ValueError):
+            return False
+
+        # The resolutions change with each axis' step mode. Pan was checked when the link was opened
+        if entry is None or entry.get("panRes") != self.PTU.panRes:
+            return False
+        if self.PTU.get_tilt_res() is None or entry.get("tiltRes") != self.PTU.tiltRes:
+            return False
+
+        self.panRange = entry["panRange"]
+        self.panRangeDeg = [self.pan_to_deg(self.panRange[0]), self.pan_to_deg(self.panRange[1])]
+        self.tiltRange = entry["tiltRange"]
+        self.tiltRangeDeg = [self.tilt_to_deg(self.tiltRange[1]), self.tilt_to_deg(self.tiltRange[0])]
+        return True
+
+    # Save the unit parameters against the unit identity
+    def save_cache(self):
+        if self.identity is None:
+            self.identity = self.PTU.get_identity()
+        if self.identity is None:
+            return
+        try:
+            with open(__cache_path__) as fin:
+                cache = json.load(fin)
+        except (IOError, ValueError):
+            cache = {}
+
+        cache[self.identity] = {"panRes": self.PTU.panRes,
+                                "tiltRes": self.PTU.tiltRes,
+                                "panRange": self.panRange,
+                                "tiltRange": self.tiltRange}
+        try:
+            with open(__cache_path__, "w") as fout:
+                json.dump(cache, fout, indent=2, sort_keys=True)
+        except IOError:
+            print "Unable to save PTU parameters to", __cache_path__
+
     def close(self):
+        self.PTU.telemetry.close_log()
         if self.PTU.serialObj is not None:
             self.PTU.serialObj.close()
 
@@ -117,6 +185,7 @@ class PTUController:
     def set_pan(self, count):
         string, self.panPos = self._input_check(str(count), self.panPos, self.panRange, self.PTU.set_pan)
         self.panPosDeg = self.pan_to_deg(self.panPos)
+        self.estimator.set_target(self.panPos, None)
         return string
 
     # return a string based on pan success
@@ -135,6 +204,7 @@ class PTUController:
     def set_tilt(self, count):
         string, self.tiltPos = self._input_check(str(count), self.tiltPos, self.tiltRange, self.PTU.set_tilt)
         self.tiltPosDeg = self.tilt_to_deg(self.tiltPos)
+        self.estimator.set_target(None, self.tiltPos)
         return string
 
     def set_tilt_deg(self, deg):
@@ -152,6 +222,7 @@ class PTUController:
     def set_pan_speed(self, count):
         string, self.panSpeed = self._input_check(str(count), self.panSpeed, None, self.PTU.set_pan_speed)
         self.panSpeedDeg = self.PTU.pan_to_deg(self.panSpeed)
+        self.estimator.set_speed(self.panSpeed, None)
         return string
 
     def set_pan_speed_deg(self, deg):
@@ -169,6 +240,7 @@ class PTUController:
     def set_tilt_speed(self, count):
         string, self.tiltSpeed = self._input_check(str(count), self.tiltSpeed, None, self.PTU.set_tilt_speed)
         self.tiltSpeedDeg = -1 * self.PTU.tilt_to_deg(self.tiltSpeed)
+        self.estimator.set_speed(None, self.tiltSpeed)
         return string
 
     def set_tilt_speed_deg(self, deg):
@@ -185,12 +257,29 @@ class PTUController:
 
     def stop(self):
         self.PTU.stop()
+        self.estimator.halt()
+
+    # Set the acceleration (counts/s^2) and base speed (counts/s) of both axes
+    def set_accel(self, panAccel, tiltAccel, panBase, tiltBase):
+        self.PTU.set_pan_base_speed(panBase)
+        self.PTU.set_tilt_base_speed(tiltBase)
+        self.PTU.set_pan_accel(panAccel)
+        self.PTU.set_tilt_accel(tiltAccel)
+        self.estimator.set_accel(panAccel, tiltAccel, panBase, tiltBase)
+
+    def set_accel_deg(self, panAccel, tiltAccel, panBase, tiltBase):
+        self.set_accel(self.deg_to_pan(panAccel), abs(self.PTU.deg_to_tilt(tiltAccel)),
+                       self.deg_to_pan(panBase), abs(self.PTU.deg_to_tilt(tiltBase)))
 
 
     ''' Getters '''
     # Get all positions and instantaneous speed parameters (count)
+    # If the unit does not reply the estimate is returned instead
     def get_pos_and_inst_speed(self):
         flList = self.PTU.get_pos_and_inst_speed()
+        if flList is None or len(flList) < 4:
+            return self.estimator.estimate()
+        self.estimator.update(float(flList[0]), float(flList[1]), float(flList[2]), float(flList[3]))
         return tuple(flList)
 
     # Get all positions and instantaneous speed parameters (deg)
@@ -202,6 +291,14 @@ class PTUController:
         tSpeed = self.tilt_to_deg(tSpeedc)
         return pan, tilt, pSpeed, tSpeed
 
+    # Estimated positions and speeds (deg, deg/s) between polls (see PTUEstimator)
+    # The unit is only polled at the poll rate or when the estimate error bound grows too large
+    def get_pos_estimate_deg(self):
+        if self.estimator.needs_poll():
+            self.get_pos_and_inst_speed()
+        pan, tilt, pSpeed, tSpeed = self.estimator.estimate()
+        return self.pan_to_deg(pan), self.tilt_to_deg(tilt), self.PTU.pan_to_deg(pSpeed), self.PTU.tilt_to_deg(tSpeed)
+
     # Get pan resolution (seconds arc per step)
     def get_pan_res(self):
         return self.PTU.panRes
@@ -269,6 +366,21 @@ class PTUController:
             self.panPosDeg = self.pan_to_deg(panPos)
         return self.panPos
 
+    # gets pan and tilt positions with a single query
+    def get_pos(self):
+        flList = self.PTU.get_pos_and_inst_speed()
+        if flList is None or len(flList) < 2:
+            self.get_pan()
+            self.get_tilt()
+        else:
+            self.panPos = int(float(flList[0]))
+            self.panPosDeg = self.pan_to_deg(self.panPos)
+            self.tiltPos = int(float(flList[1]))
+            self.tiltPosDeg = self.tilt_to_deg(self.tiltPos)
+            if len(flList) >= 4:
+                self.estimator.update(self.panPos, self.tiltPos, float(flList[2]), float(flList[3]))
+        return self.panPos, self.tiltPos
+
     # get pan position in degrees
     def get_pan_deg(self):
         self.get_pan()
@@ -301,6 +413,7 @@ class PTUController:
         else:
             self.panSpeed = panSpeed
             self.panSpeedDeg = self.pan_to_deg(panSpeed)
+        self.estimator.set_speed(self.panSpeed, None)
         return self.panSpeed
 
     # get pan speed in degrees/s
@@ -318,6 +431,7 @@ class PTUController:
         else:
             self.tiltSpeed = tiltSpeed
             self.tiltSpeedDeg = self.tilt_to_deg(tiltSpeed)
+        self.estimator.set_speed(None, self.tiltSpeed)
         return self.tiltSpeed
 
     # get pan speed in degrees/s
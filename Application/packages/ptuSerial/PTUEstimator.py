@@ -0,0 +1,152 @@
+import math
+
+from .. other import Utilities as u
+
+
+class AxisEstimate:
+    '''
+        Dead reckoning of a single axis in position mode (counts)
+        * the axis ramps towards the commanded speed at the acceleration limit and slows
+            so it stops at the target, as the PTU does
+        * starts from the base speed as the unit jumps straight to it
+    '''
+
+    __step__ = 0.005        # integration step (s)
+
+    def __init__(self, accel, baseSpeed=0.0):
+        self.pos = 0.0
+        self.vel = 0.0
+        self.target = 0.0
+        self.speed = 1.0
+        self.accel = float(accel)
+        self.baseSpeed = float(baseSpeed)
+
+    def reset(self, pos, vel):
+        self.pos = float(pos)
+        self.vel = float(vel)
+
+    def advance(self, dt):
+        ''' Integrates the motion forward dt seconds '''
+        while dt > 0:
+            step = min(dt, self.__step__)
+            dist = self.target - self.pos
+            if dist == 0 and self.vel == 0:
+                return
+
+            # Fastest speed that can still stop at the target
+            desired = min(abs(self.speed), math.sqrt(2.0 * self.accel * abs(dist)) + self.baseSpeed)
+            desired = math.copysign(desired, dist)
+            if self.vel == 0:
+                # The unit starts at its base speed
+                self.vel = math.copysign(min(self.baseSpeed, abs(desired)), dist)
+            maxChange = self.accel * step
+            self.vel += max(-maxChange, min(maxChange, desired - self.vel))
+
+            newPos = self.pos + self.vel * step
+            # Stop at the target rather than overshoot it
+            if (self.target - newPos) * dist <= 0:
+                self.pos = self.target
+                self.vel = 0.0
+                return
+            self.pos = newPos
+            dt -= step
+
+
+class PTUEstimator:
+    '''
+        Estimates the PTU position between position polls
+        * every target and speed sent to the unit is integrated forward in time (see AxisEstimate)
+        * the error bound grows with the time since the last poll, faster while moving
+        * needs_poll says when a real poll is due: at pollRate or once the bound is too large
+    '''
+
+    __drift__ = 0.02        # error bound growth while stationary (deg/s)
+    __motion_error__ = 0.05 # error bound growth as a fraction of the distance travelled
+
+    def __init__(self, PTU, panAccel, tiltAccel, pollRate=2.0, maxError=0.5):
+        self.PTU = PTU                  # PTUSerial (for the resolutions)
+        self.pan = AxisEstimate(panAccel)
+        self.tilt = AxisEstimate(tiltAccel)
+        self.pollRate = pollRate        # polls per second (0 only polls on the error bound)
+        self.maxError = maxError        # largest error bound (deg) before polling
+        self.time = None                # monotonic time of the estimate
+        self.pollTime = None            # monotonic time of the last poll
+        self.travel = 0.0               # degrees moved since the last poll
+        self.polls = 0
+        self.estimates = 0
+
+    def _advance(self):
+        now = u.monotonic()
+        if self.time is not None:
+            start = (self.pan.pos, self.tilt.pos)
+            self.pan.advance(now - self.time)
+            self.tilt.advance(now - self.time)
+            self.travel += abs(self.pan.pos - start[0]) * self.PTU.panRes / 3600.0 + \
+                abs(self.tilt.pos - start[1]) * self.PTU.tiltRes / 3600.0
+        self.time = now
+
+    def set_target(self, pan, tilt):
+        ''' A new position command (counts). None leaves an axis unchanged '''
+        self._advance()
+        if pan is not None:
+            self.pan.target = pan
+        if tilt is not None:
+            self.tilt.target = tilt
+
+    def set_speed(self, pan, tilt):
+        ''' A new speed command (counts/s). None leaves an axis unchanged '''
+        self._advance()
+        if pan is not None:
+            self.pan.speed = abs(pan)
+        if tilt is not None:
+            self.tilt.speed = abs(tilt)
+
+    def set_accel(self, pan, tilt, panBase=None, tiltBase=None):
+        ''' Acceleration (counts/s^2) and base speed (counts/s) limits '''
+        if pan is not None:
+            self.pan.accel = float(pan)
+        if tilt is not None:
+            self.tilt.accel = float(tilt)
+        if panBase is not None:
+            self.pan.baseSpeed = float(panBase)
+        if tiltBase is not None:
+            self.tilt.baseSpeed = float(tiltBase)
+
+    def halt(self):
+        ''' The unit was stopped. It is assumed to stop where it is and is polled next '''
+        self._advance()
+        self.pan.target = self.pan.pos
+        self.tilt.target = self.tilt.pos
+        self.pollTime = None
+
+    def update(self, pan, tilt, panVel, tiltVel):
+        ''' Resets the estimate from a poll of the unit (counts and counts/s) '''
+        self.pan.reset(pan, panVel)
+        self.tilt.reset(tilt, tiltVel)
+        if self.polls == 0:
+            # Nothing has been commanded yet so the unit is where it is heading
+            self.pan.target = self.pan.pos
+            self.tilt.target = self.tilt.pos
+        self.time = u.monotonic()
+        self.pollTime = self.time
+        self.travel = 0.0
+        self.polls += 1
+
+    def estimate(self):
+        ''' Current (pan, tilt, panVel, tiltVel) in counts '''
+        self._advance()
+        self.estimates += 1
+        return self.pan.pos, self.tilt.pos, self.pan.vel, self.tilt.vel
+
+    def error_bound(self):
+        ''' Rough bound on the estimate error (deg) '''
+        if self.pollTime is None:
+            return float("inf")
+        return self.__drift__ * (u.monotonic() - self.pollTime) + self.__motion_error__ * self.travel
+
+    def needs_poll(self):
+        if self.pollTime is None:
+            return True
+        if self.pollRate > 0 and u.monotonic() - self.pollTime >= 1.0 / self.pollRate:
+            return True
+        return self.error_bound() > self.maxError
@@ -1,5 +1,17 @@
 import serial
 import re
+import time
+
+from .. other import Utilities as u
+from .. other.Profiler import profiler
+from SerialTelemetry import SerialTelemetry
+
+__baud_rates__ = [9600, 19200, 38400, 57600, 115200]   # rates supported by the PTU
+__probe_timeout__ = 0.3                                 # seconds to wait for a reply when probing
+__link_timeout__ = 1.0                                  # seconds before a command is an error (negotiated links)
+__verify_count__ = 5                                    # round trips needed to accept a baud rate
+__switch_delay__ = 0.1                                  # seconds for the PTU to change baud rate
+__max_errors__ = 3                                      # consecutive errors before falling back a rate
 
 
 class PTUSerial:
@@ -12,15 +24,46 @@ class PTUSerial:
         exactly as you tell it to
     '''
 
-    def __init__(self, port, baudrate):
+    def __init__(self, port, baudrate, maxBaud=None, queryRes=True):
         # Serial object user for interfacing
         self.serialObj = serial.Serial(port=port, baudrate=baudrate)
-
-        # Resolution
-        self.panRes = self.get_pan_res()
-        self.tiltRes = self.get_tilt_res()
+        self.baudrate = baudrate
+
+        # Command counters and latencies for the link
+        self.telemetry = SerialTelemetry(baudrate)
+
+        # Link error handling (timeout None waits forever)
+        self.timeout = None
+        self.maxBaud = maxBaud
+        self.errors = 0
+        self.negotiating = False
+        self.panRes = None
+        self.tiltRes = None
+        self.linkPanRes = None      # pan resolution from the last round trip test
+
+        # Find the rate the PTU is currently using and raise it if allowed
+        # If it does not reply (e.g. powered off) wait for it at the given rate
+        if self.probe_baud([baudrate] + __baud_rates__) is None:
+            print "PTU did not respond at any baud rate. Waiting for it at", baudrate
+            while self.probe_baud([baudrate]) is None:
+                pass
+        if maxBaud is not None:
+            self.timeout = __link_timeout__
+            self.negotiate_baud(maxBaud)
+
+        # Resolution (without queryRes the caller sets tiltRes, e.g. from a cache)
+        if queryRes is True or self.linkPanRes is None:
+            self.panRes = self.get_pan_res()
+        else:
+            self.panRes = self.linkPanRes
+        if queryRes is True:
+            self.tiltRes = self.get_tilt_res()
     # Write message to PTU, return reflected message
-    def write(self, msg):
+    # If timeout (s) passes without a reply None is returned
+    def write(self, msg, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        t = profiler.start()
         self.serialObj.write(msg)
         retString = ""
 
@@ -30,12 +73,122 @@ class PTUSerial:
                 s = self.serialObj.read()
                 retString += s
                 if s == "\n":
+                    cmd = self.command_type(msg)
+                    elapsed = profiler.stop("ptu " + cmd, t)
+                    self.telemetry.record(cmd, len(msg), len(retString), t, elapsed)
+                    self.errors = 0
                     return retString
+            elif timeout is not None and u.monotonic() - t > timeout:
+                self.telemetry.record_timeout(self.command_type(msg))
+                self._on_error()
+                return None
+
+    ''' Baud rate commands '''
+    # Change the rate of the serial port only
+    def set_local_baud(self, baudrate):
+        self.serialObj.baudrate = baudrate
+        self.baudrate = baudrate
+        self.telemetry.baudrate = baudrate
+        self.serialObj.flushInput()
+
+    # Round trip test. True if every reply is a matching pan resolution
+    def verify_link(self, count=__verify_count__, timeout=__probe_timeout__):
+        expected = self.panRes
+        for i in range(count):
+            res = self.float_from_string(self.write("pr ", timeout=timeout))
+            if res is None:
+                return False
+            self.linkPanRes = res
+            if expected is None:
+                expected = res
+            elif res != expected:
+                return False
+        return True
+
+    # Find the rate the PTU is using. Returns the rate or None if there was no reply
+    def probe_baud(self, rates=None):
+        if rates is None:
+            rates = __baud_rates__
+        self.negotiating = True
+        found = None
+        tried = []
+        for rate in rates:
+            if rate in tried:
+                continue
+            tried.append(rate)
+            self.set_local_baud(rate)
+            if self.verify_link(count=2) is True:
+                found = rate
+                break
+        self.negotiating = False
+        return found
+
+    # Change the PTU to the given rate. Returns True if the new rate passes a round trip test
+    def set_baud(self, baudrate):
+        prevBaud = self.baudrate
+        self.negotiating = True
+        self.serialObj.write(" @(" + str(int(baudrate)) + ",0,F) ")
+        self.serialObj.flush()
+        time.sleep(__switch_delay__)
+        self.set_local_baud(baudrate)
+        time.sleep(__switch_delay__)
+        success = self.verify_link()
+        self.negotiating = False
+
+        if success is False:
+            # The PTU state is unknown so find it again
+            if self.probe_baud([prevBaud, baudrate] + __baud_rates__) is None:
+                self.set_local_baud(prevBaud)
+        return success
+
+    # Raise the link to the highest rate up to maxBaud that passes a round trip test
+    def negotiate_baud(self, maxBaud):
+        startBaud = self.baudrate
+        for rate in reversed(__baud_rates__):
+            if rate <= startBaud or rate > maxBaud:
+                continue
+            if self.set_baud(rate) is True:
+                break
+        return self.baudrate
+
+    # Drop to the next lower supported rate (used when the link produces errors)
+    def fall_back(self):
+        lower = [r for r in __baud_rates__ if r < self.baudrate]
+        while len(lower) > 0:
+            if self.set_baud(lower.pop()) is True:
+                break
+        return self.baudrate
+
+    def _on_error(self):
+        if self.negotiating is True or self.maxBaud is None:
+            return
+        self.errors += 1
+        if self.errors >= __max_errors__:
+            self.errors = 0
+            print "PTU link errors at", self.baudrate, "falling back"
+            self.fall_back()
+            print "\tNow at", self.baudrate
+
+    # Returns the link statistics (commands, bytes and latencies per command type)
+    def get_stats(self):
+        return self.telemetry.stats()
+
+    # Stream every command to a csv (or binary) log
+    def open_log(self, path, binary=False):
+        self.telemetry.open_log(path, binary)
+
+    # Returns the command letters of a message. eg " pp100 " -> "pp"
+    def command_type(self, msg):
+        m = re.match("\s*([A-Za-z@]*)", msg)
+        if m is not None and len(m.group(1)) > 0:
+            return m.group(1)
+        return "?"
 
     def stop(self):
         self.write("H ")
 
     def close(self):
+        self.telemetry.close_log()
         if self.serialObj is not None:
             self.serialObj.close()
 
@@ -79,20 +232,58 @@ class PTUSerial:
         retString = self.write("ts" + str(self.deg_to_tilt(speedDeg)) + " ")
         return retString
 
+    ''' Acceleration and base speed commands '''
+    # Set pan acceleration in counts/s^2
+    def set_pan_accel(self, accel):
+        return self.write("pa" + str(int(accel)) + " ")
+
+    # Set tilt acceleration in counts/s^2
+    def set_tilt_accel(self, accel):
+        return self.write("ta" + str(int(accel)) + " ")
+
+    # Get pan acceleration in counts/s^2
+    def get_pan_accel(self):
+        return self.float_from_string(self.write("pa "))
+
+    # Get tilt acceleration in counts/s^2
+    def get_tilt_accel(self):
+        return self.float_from_string(self.write("ta "))
+
+    # Set pan base (start up) speed in counts/s
+    def set_pan_base_speed(self, speed):
+        return self.write("pb" + str(int(speed)) + " ")
+
+    # Set tilt base (start up) speed in counts/s
+    def set_tilt_base_speed(self, speed):
+        return self.write("tb" + str(int(speed)) + " ")
+
     ''' Resolution commands '''
+    # Without a reply the last known resolution is kept
     # Get pan resolution (seconds arc per step)
     def get_pan_res(self):
-        retString = self.write("pr ")
-        self.panRes = self.float_from_string(retString)
+        res = self.float_from_string(self.write("pr "))
+        if res is not None:
+            self.panRes = res
         return self.panRes
 
     # Get tilt res (seconds arc per step)
     def get_tilt_res(self):
-        retString = self.write("tr ")
-        self.tiltRes = self.float_from_string(retString)
+        res = self.float_from_string(self.write("tr "))
+        if res is not None:
+            self.tiltRes = res
         return self.tiltRes
 
 
+    # Get the unit identity (serial number). None if the unit can not report one
+    def get_identity(self):
+        retString = self.write("VS ")
+        if retString is None or retString.strip().startswith("*") is False:
+            return None
+        if self.floats_from_string(retString) is None:
+            return None
+        return retString.strip()
+
+
     ''' Max/Min commands '''
     # Get min pan position in counts
     def get_min_pan(self):
@@ -183,7 +374,7 @@ class PTUSerial:
     def change_pan_mode(self, mode, cspeed=500):
         self.set_pan_speed(cspeed)
         checkString = self.write("WP ")
-        if str(mode) not in checkString:
+        if checkString is None or str(mode) not in checkString:
             retString = self.write("WP" + str(mode) + " ")
             return retString
         return None
@@ -191,7 +382,7 @@ class PTUSerial:
     def change_tilt_mode(self, mode, cspeed=500):
         self.set_tilt_speed(cspeed)
         checkString = self.write("WT ")
-        if str(mode) not in checkString:
+        if checkString is None or str(mode) not in checkString:
             retString = self.write("WT" + str(mode) + " ")
             return retString
         return None
@@ -214,14 +405,17 @@ class PTUSerial:
     def deg_to_tilt(self, tiltDeg):
         return int(-3600 * float(tiltDeg) / self.tiltRes)
 
+    # A reply of None (timed out) is no reply and gives None
     def float_from_string(self, string):
         fl = self.floats_from_string(string)
-        if len(fl) > 0:
+        if fl is not None:
             return float(fl[0])
         else:
             return None
 
     def floats_from_string(self, string):
+        if string is None:
+            return None
         string = str(string)  # Ensure string
         fl = re.findall("[-+]?\d*\.\d+|[-+]?\d+", string)
         if len(fl) > 0:
@@ -0,0 +1,134 @@
+import numpy as np
+
+import Calibration
+from .. other import Utilities as u
+
+
+class Reachability:
+    '''
+        Where the PTU can point, from its pan and tilt ranges and the transform
+
+        * a direction can be reached directly (pan, tilt) or, if the tilt range goes past
+            the zenith, flipped over the top (pan + 180, 180 - tilt)
+        * pan moves can not cross the dead zone behind the unit (outside panRangeDeg), so
+            the unit always travels the straight pan difference. plan picks the legal pose
+            with the shortest move from the current position
+        * image_map and sky_map are precomputed boolean maps so detections can be checked
+            with a single lookup
+    '''
+
+    __az_step__ = 1.0       # sky map resolution (deg)
+    __alt_step__ = 1.0
+
+    def __init__(self, PTU):
+        self.PTU = PTU                  # PTUController (ranges and transform)
+        self.imageKey = None
+        self.image = None
+        self.sky = None
+        self.update_ranges()
+
+    def update_ranges(self):
+        ''' Reads the ranges from the PTU. Call again if they are changed '''
+        self.panRange = (float(min(self.PTU.panRangeDeg)), float(max(self.PTU.panRangeDeg)))
+        self.tiltRange = (float(min(self.PTU.tiltRangeDeg)), float(max(self.PTU.tiltRangeDeg)))
+        self.canFlip = self.tiltRange[1] > 90.0
+        self.imageKey = None
+        self.image = None
+        self.sky = None
+
+    def _legal(self, pan, tilt):
+        ''' Vectorised check of poses against the ranges '''
+        return (pan >= self.panRange[0]) & (pan <= self.panRange[1]) & \
+               (tilt >= self.tiltRange[0]) & (tilt <= self.tiltRange[1])
+
+    def reachable(self, pan, tilt, flip=True):
+        '''
+            Vectorised. True where the direction (pan, tilt) can be reached by any pose
+            * without flip only the direct pose counts (for callers that never flip)
+        '''
+        pan = np.asarray(pan, np.float64)
+        tilt = np.asarray(tilt, np.float64)
+        ok = self._legal(pan, tilt)
+        if self.canFlip is True and flip is True:
+            ok |= self._legal(u.within_pi_array(pan + 180.0), 180.0 - tilt)
+        return ok
+
+    def poses(self, pan, tilt):
+        ''' Legal poses (pan, tilt) that point in the direction (pan, tilt) '''
+        candidates = [(u.within_pi(pan), tilt)]
+        if self.canFlip is True:
+            candidates.append((u.within_pi(pan + 180.0), 180.0 - tilt))
+        return [p for p in candidates if self._legal(p[0], p[1])]
+
+    def plan(self, curPos, target):
+        '''
+            Shortest legal pose for target (pan, tilt in deg) from curPos
+            * moves are timed at the transform's maximum speeds, the slower axis decides
+            * returns None if the target is in the dead zone
+        '''
+        poses = self.poses(target[0], target[1])
+        if len(poses) == 0:
+            return None
+        transform = self.PTU.transform
+
+        def travel(pose):
+            return max(abs(pose[0] - curPos[0]) / transform.__max_pan_speed__,
+                       abs(pose[1] - curPos[1]) / transform.__max_tilt_speed__)
+
+        return min(poses, key=travel)
+
+    def clamp(self, target):
+        ''' Nearest pose within the ranges to a target (pan, tilt) '''
+        return (min(max(target[0], self.panRange[0]), self.panRange[1]),
+                min(max(target[1], self.tiltRange[0]), self.tiltRange[1]))
+
+    def image_map(self, shape, center):
+        '''
+            Boolean map over a wide angle image (flipped as in MotionTracking) of the
+            pixels the PTU can reach
+            * center is the (x, y) used by MotionTracking. The map is cached per shape and center
+            * pixels outside the lens are unreachable
+        '''
+        key = (tuple(shape[:2]), tuple(center))
+        if self.imageKey != key:
+            transform = self.PTU.transform
+            y, x = np.mgrid[0:shape[0], 0:shape[1]].astype(np.float64)
+            dx = x - center[0]
+            dy = y - center[1]
+            alpha = -np.degrees(np.arctan2(dy, dx))
+            radius = np.hypot(dx, dy)
+            pan, tilt = Calibration.model(transform, {}, alpha, radius)
+            self.image = self.reachable(pan, tilt) & (radius <= transform.__maxLensRadius__)
+            self.imageKey = key
+        return self.image
+
+    def is_reachable_pt(self, pt):
+        ''' Lookup of an (x, y) pixel in the last image map '''
+        if self.image is None:
+            return True
+        x = int(pt[0])
+        y = int(pt[1])
+        if 0 <= y < self.image.shape[0] and 0 <= x < self.image.shape[1]:
+            return bool(self.image[y, x])
+        return False
+
+    def sky_map(self, to_pan_tilt, azStep=__az_step__, altStep=__alt_step__, flip=True):
+        '''
+            Boolean map of the sky the PTU can reach, indexed [alt, az] on a
+            (0 - 90) x (0 - 360) grid
+            * to_pan_tilt converts az and alt arrays (deg) to PTU pan and tilt (deg)
+            * flip is passed to reachable
+        '''
+        alt, az = np.mgrid[0:90.0 + altStep / 2.0:altStep, 0:360.0:azStep]
+        pan, tilt = to_pan_tilt(az, alt)
+        self.sky = (self.reachable(pan, tilt, flip), azStep, altStep)
+        return self.sky[0]
+
+    def is_reachable_sky(self, az, alt):
+        ''' Vectorised lookup of az and alt (deg) in the last sky map '''
+        if self.sky is None:
+            return np.ones(np.shape(az), bool)
+        sky, azStep, altStep = self.sky
+        i = np.clip(np.round(np.asarray(alt) / altStep).astype(int), 0, sky.shape[0] - 1)
+        j = np.round(np.mod(az, 360.0) / azStep).astype(int) % sky.shape[1]
+        return sky[i, j]
@@ -0,0 +1,121 @@
+import csv
+import json
+import struct
+import numpy as np
+
+from .. other import Utilities as u
+from .. other.Profiler import Profiler
+
+
+# Record layout of the binary log (little endian, 24 bytes per command)
+__log_format__ = "<d4sHHf4x"
+__log_dtype__ = np.dtype([("time", "<f8"), ("cmd", "S4"), ("tx", "<u2"), ("rx", "<u2"),
+                          ("latency", "<f4"), ("pad", "V4")])
+
+
+def read_log(path):
+    ''' Reads a binary telemetry log into a numpy structured array (time, cmd, tx, rx, latency) '''
+    return np.fromfile(path, dtype=__log_dtype__)
+
+
+class SerialTelemetry:
+    '''
+        Counters for the serial link to the PTU
+
+        * round trip latency histograms per command type (see Profiler)
+        * commands and bytes sent and received per command type
+        * link utilisation from the bytes sent against the baud rate (10 bits per byte)
+        * each command can be streamed to a csv or binary log file
+    '''
+
+    def __init__(self, baudrate):
+        self.baudrate = baudrate
+        self.latency = Profiler()
+        self.commands = {}      # cmd -> [count, tx bytes, rx bytes]
+        self.txBytes = 0
+        self.rxBytes = 0
+        self.timeouts = {}      # cmd -> number of commands without a reply
+        self.startTime = u.monotonic()
+        self.log = None
+        self.logWriter = None
+        self.logBinary = False
+
+    def record(self, cmd, tx, rx, start, elapsed):
+        ''' Records a single command of tx bytes sent and rx bytes received '''
+        counts = self.commands.get(cmd)
+        if counts is None:
+            counts = [0, 0, 0]
+            self.commands[cmd] = counts
+        counts[0] += 1
+        counts[1] += tx
+        counts[2] += rx
+        self.txBytes += tx
+        self.rxBytes += rx
+        self.latency.record(cmd, elapsed)
+
+        if self.log is not None:
+            if self.logBinary is True:
+                self.log.write(struct.pack(__log_format__, start, cmd[:4], tx, rx, elapsed * 1000.0))
+            else:
+                self.logWriter.writerow([start, cmd, tx, rx, elapsed * 1000.0])
+
+    def record_timeout(self, cmd):
+        ''' Records a command that did not get a reply '''
+        self.timeouts[cmd] = self.timeouts.get(cmd, 0) + 1
+
+    def reset(self):
+        ''' Clears all counters '''
+        self.latency.reset()
+        self.commands = {}
+        self.txBytes = 0
+        self.rxBytes = 0
+        self.timeouts = {}
+        self.startTime = u.monotonic()
+
+    def stats(self):
+        '''
+            Returns the link statistics
+            * rates are bytes/s since the last reset
+            * latencies are in ms
+        '''
+        elapsed = u.monotonic() - self.startTime
+        if elapsed <= 0:
+            elapsed = 1e-9
+        latency = self.latency.summary()
+        commands = {}
+        for cmd, counts in self.commands.items():
+            commands[cmd] = {"count": counts[0], "tx": counts[1], "rx": counts[2],
+                             "rate": counts[0] / elapsed, "latency": latency.get(cmd)}
+
+        return {"baudrate": self.baudrate,
+                "seconds": elapsed,
+                "commands": commands,
+                "count": sum(c[0] for c in self.commands.values()),
+                "txBytes": self.txBytes,
+                "rxBytes": self.rxBytes,
+                "txRate": self.txBytes / elapsed,
+                "rxRate": self.rxBytes / elapsed,
+                "timeouts": dict(self.timeouts),
+                "utilisation": 10.0 * (self.txBytes + self.rxBytes) / (elapsed * self.baudrate)}
+
+    def dump(self, path):
+        ''' Saves the current statistics as json '''
+        with open(path, "w") as fout:
+            json.dump(self.stats(), fout, indent=2, sort_keys=True)
+
+    def open_log(self, path, binary=False):
+        ''' Streams every command to path. Binary logs can be read back with read_log '''
+        self.close_log()
+        self.logBinary = binary
+        if binary is True:
+            self.log = open(path, "wb")
+        else:
+            self.log = open(path, "w")
+            self.logWriter = csv.writer(self.log, delimiter=',')
+            self.logWriter.writerow(["Time", "Command", "Tx", "Rx", "Latency"])
+
+    def close_log(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+            self.logWriter = None
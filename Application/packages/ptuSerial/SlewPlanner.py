@@ -0,0 +1,120 @@
+import math
+
+from .. other import Utilities as u
+
+
+def profile_time(distance, speed, accel, base=0.0):
+    '''
+        Time (s) and peak speed of the fastest trapezoidal move over distance (deg)
+        * starts and stops at the base speed, ramps at accel and cruises at speed
+        * short moves never reach speed and have a triangular profile
+    '''
+    distance = abs(distance)
+    if distance == 0:
+        return 0.0, 0.0
+    speed = max(speed, base)
+    ramps = (speed * speed - base * base) / accel       # distance to ramp up and back down
+    if distance >= ramps:
+        return 2.0 * (speed - base) / accel + (distance - ramps) / speed, speed
+    peak = math.sqrt(accel * distance + base * base)
+    return 2.0 * (peak - base) / accel, peak
+
+
+def speed_for_time(distance, duration, accel, base=0.0):
+    '''
+        Cruise speed that makes a trapezoidal move over distance take duration (s)
+        * used to slow the quicker axis so both axes arrive together
+        * None if the move can not be made that slowly with these limits
+    '''
+    distance = abs(distance)
+    if distance == 0 or duration <= 0:
+        return None
+    # (v - base)^2 - accel * duration * v + accel * distance = 0
+    b = 2.0 * base + accel * duration
+    disc = b * b - 4.0 * (base * base + accel * distance)
+    if disc < 0:
+        return None
+    return max((b - math.sqrt(disc)) / 2.0, base)
+
+
+class SlewPlanner:
+    '''
+        Minimum time slews for acquiring a new target
+
+        * both axes follow trapezoidal speed profiles at the acceleration and speed limits
+        * the axis with the shorter move is slowed to arrive with the other, so the
+            payload sweeps straight to the target
+        * configure writes the acceleration and base speed registers so the unit follows
+            the same profile that was planned
+        * a slew is finished once the estimated position is within handover of the target
+            (or the planned time has passed) and fine tracking takes over
+    '''
+
+    __pan_accel__ = 300.0       # deg/s^2
+    __tilt_accel__ = 200.0      # deg/s^2
+    __base_speed__ = 1.0        # deg/s. At or below the slowest tracking speed
+    __handover__ = 1.0          # deg from the target when fine tracking takes over
+    __margin__ = 0.1            # seconds added to the planned time before handing over anyway
+
+    def __init__(self, PTU):
+        self.PTU = PTU
+        self.panSpeed = PTU.transform.__max_pan_speed__
+        self.tiltSpeed = PTU.transform.__max_tilt_speed__
+        self.configured = False
+        self.target = None
+        self.deadline = None
+
+    def configure(self):
+        ''' Writes the acceleration and base speed limits to the unit '''
+        self.PTU.set_accel_deg(self.__pan_accel__, self.__tilt_accel__, self.__base_speed__, self.__base_speed__)
+        self.configured = True
+
+    def plan(self, curPos, target):
+        '''
+            Plans a slew from curPos to target (pan, tilt in deg)
+            * returns (time, panSpeed, tiltSpeed) with speeds in deg/s
+        '''
+        dPan = target[0] - curPos[0]
+        dTilt = target[1] - curPos[1]
+        panTime, panPeak = profile_time(dPan, self.panSpeed, self.__pan_accel__, self.__base_speed__)
+        tiltTime, tiltPeak = profile_time(dTilt, self.tiltSpeed, self.__tilt_accel__, self.__base_speed__)
+        duration = max(panTime, tiltTime)
+
+        # Slow the quicker axis to arrive together
+        panSpeed = self.panSpeed
+        tiltSpeed = self.tiltSpeed
+        if panTime < duration:
+            panSpeed = speed_for_time(dPan, duration, self.__pan_accel__, self.__base_speed__) or self.__base_speed__
+        if tiltTime < duration:
+            tiltSpeed = speed_for_time(dTilt, duration, self.__tilt_accel__, self.__base_speed__) or self.__base_speed__
+        return duration, panSpeed, tiltSpeed
+
+    def start(self, curPos, target):
+        ''' Plans and sends a slew. Returns the planned time (s) '''
+        if self.configured is False:
+            self.configure()
+        duration, panSpeed, tiltSpeed = self.plan(curPos, target)
+        self.PTU.set_pan_speed_deg(panSpeed)
+        self.PTU.set_tilt_speed_deg(tiltSpeed)
+        self.PTU.set_pan_deg(target[0])
+        self.PTU.set_tilt_deg(target[1])
+        self.target = target
+        self.deadline = u.monotonic() + duration + self.__margin__
+        return duration
+
+    def cancel(self):
+        ''' Forgets the slew so something else can command the unit '''
+        self.target = None
+        self.deadline = None
+
+    def is_slewing(self, curPos):
+        ''' True until curPos reaches the target or the planned time has passed '''
+        if self.target is None:
+            return False
+        near = abs(curPos[0] - self.target[0]) < self.__handover__ and \
+            abs(curPos[1] - self.target[1]) < self.__handover__
+        if near is True or u.monotonic() > self.deadline:
+            self.target = None
+            self.deadline = None
+            return False
+        return True
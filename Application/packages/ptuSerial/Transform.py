@@ -1,13 +1,17 @@
 import math
+import os
 from .. other import Utilities as u
 
+__settings__ = os.path.dirname(os.path.realpath(__file__)) + "/transform.txt"
+
 
 class Tranform():
     '''
         This is an object that controls transformations from wide angle lens coordinates
         to PTU coordinates in degrees
 
-        Variables can be loaded from a config file (yet to be implemented but can be changed here)
+        Variables can be loaded from a config file (transform.txt, written by Calibration) or
+        changed here
 
         This allows for both static (single point) and dynamic (trajectory and motion)
         approximations for input points
@@ -25,6 +29,22 @@ class Tranform():
     __del_arm__ = 0.12                  # distance from center of camera to pivot
     __rho__ = 1.5                       # distance of expected object from camera
 
+    __phi_per_radius__ = 0.4647         # wide angle phi (deg) per pixel of radius
+    __tilt_per_radius__ = -0.464        # static tilt = a * radius + b
+    __tilt_at_center__ = 90.351
+    __radius_per_tilt__ = -2.151        # static radius = a * tilt + b
+    __radius_at_zero_tilt__ = 194.43
+
+    __payload_deg_per_px__ = 0.0125     # payload plate scale (deg per pixel)
+    __payload_pan_sign__ = -1.0         # pan direction of +x in the payload image
+    __payload_tilt_sign__ = 1.0         # tilt direction of +y in the payload image
+
+    # Values that can be set from the settings file
+    __settings_keys__ = ["markerFromNormal", "__del_x__", "__del_y__", "__del_z__", "__rho__",
+                         "__phi_per_radius__", "__tilt_per_radius__",
+                         "__tilt_at_center__", "__radius_per_tilt__", "__radius_at_zero_tilt__",
+                         "__payload_deg_per_px__", "__payload_pan_sign__", "__payload_tilt_sign__"]
+
     __speed_delta_factor__ = 4.0        # Speed delta. Used in increase PTU speed when far away
     __max_pan_speed__ = 150.0
     __min_pan_speed__ = 5.0
@@ -36,16 +56,41 @@ class Tranform():
     curPt = None                        # Current pt being analysed dynamically
     staticPt = None                     # Current pt being analysed statically
 
-    def __init__(self):
+    def __init__(self, settings=__settings__):
+        self.load_settings(settings)
+        self.prevInstPos = None
+
+    def _update_derived(self):
         # Calculate straight distance between wide angle and PTU
         self.__del_rho__ = math.hypot(self.__del_x__, self.__del_y__)
         # Calculate angle between PTU and payload
         self.__delta__ = math.degrees(math.atan2(self.__del_y__, self.__del_x__))
-        self.prevInstPos = None
+        # Inverse of the wide angle lens scale (pixels of radius per degree of phi)
+        self.__radius_per_phi__ = 1.0 / self.__phi_per_radius__
 
-    def load_settings(self):
-        ''' Call to read in user settings from transform.txt '''
-        pass
+    def load_settings(self, path=__settings__):
+        '''
+            Call to read in user settings from transform.txt
+            * each line is "name value" for a name in __settings_keys__, # starts a comment
+            * missing files or names keep the defaults above
+        '''
+        if path is not None and os.path.exists(path):
+            with open(path) as fin:
+                for line in fin:
+                    parts = line.split("#")[0].split()
+                    if len(parts) == 2 and parts[0] in self.__settings_keys__:
+                        try:
+                            setattr(self, parts[0], float(parts[1]))
+                        except ValueError:
+                            pass
+        self._update_derived()
+
+    def save_settings(self, path=__settings__):
+        ''' Writes the current settings so they are loaded by load_settings '''
+        with open(path, "w") as fout:
+            fout.write("# Transform settings (see Transform.load_settings)\n")
+            for name in self.__settings_keys__:
+                fout.write("{} {!r}\n".format(name, float(getattr(self, name))))
 
     def calculate_pan_tilt(self, alpha, radius):
         ''' Calculates pan and tilt angles for PTU based on raw image position and radius from center'''
@@ -87,12 +132,12 @@ class Tranform():
     def camera_radius_to_phi(self, radius):
         ''' Takes in the radius from center of the wide angle and gives phi from z-axis as 0'''
         # This is a function based on testing and not spherical coordinates
-        phi = 0.4647 * radius
+        phi = self.__phi_per_radius__ * radius
         return u.within_pi(phi)
 
     def camera_phi_to_radius(self, phi):
         ''' This is not accurate and only an approximation'''
-        radius = phi / 0.492
+        radius = phi * self.__radius_per_phi__
         return radius
 
     ''' Coordinate transforms '''
@@ -152,12 +197,12 @@ class Tranform():
 
     def radius_to_tilt_deg(self, radius):
         ''' Converts radius to tilt coord in degrees '''
-        tilt = -0.464 * float(radius) + 90.351
+        tilt = self.__tilt_per_radius__ * float(radius) + self.__tilt_at_center__
         return float(tilt)
 
     def tilt_deg_to_radius(self, tilt):
         ''' Converts tilt coord to wide angle radius '''
-        radius = -2.151 * float(tilt) + 194.43
+        radius = self.__radius_per_tilt__ * float(tilt) + self.__radius_at_zero_tilt__
         return float(radius)
 
     ''' Dynamic equations '''
@@ -186,7 +231,15 @@ class Tranform():
         tilt = targetPos[1]
 
         # Calculate the desired speed
-        targetSpeed = self.tuple_multi(self.tuple_subtract(targetPos, (curPan, curTilt)), self.__speed_delta_factor__)
+        panSpeed, tiltSpeed = self.speed_to_pos(targetPos, (curPan, curTilt))
+
+        self.prevInstPos = instPos
+
+        return pan, tilt, panSpeed, tiltSpeed
+
+    def speed_to_pos(self, targetPos, curPos):
+        ''' Pan and tilt speeds (deg/s) for a move from curPos to targetPos, within the speed limits '''
+        targetSpeed = self.tuple_multi(self.tuple_subtract(targetPos, curPos), self.__speed_delta_factor__)
         panSpeed = math.fabs(targetSpeed[0])
         tiltSpeed = math.fabs(targetSpeed[1])
 
@@ -202,9 +255,7 @@ class Tranform():
         if tiltSpeed < self.__min_tilt_speed__:
             tiltSpeed = self.__min_tilt_speed__
 
-        self.prevInstPos = instPos
-
-        return pan, tilt, panSpeed, tiltSpeed
+        return panSpeed, tiltSpeed
 
 
     ''' Other functions '''